@@ -1,6 +1,10 @@
 import requests
 import xml.etree.ElementTree as ET
+import json
+import os
+import shutil
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 # De basis URL en parameters
 # BASE_URL = "https://rcerijswijk.adlibhosting.com/api.wo2/wwwopac.ashx" # Objectgegevens NK collectie
@@ -12,84 +16,194 @@ LIMIT = 50
 START_FROM = 1
 OUTPUT_FILE = "../" + DATABASE + ".xml"
 
-# Maak een nieuw, leeg XML-hoofdelement aan voor het gecombineerde bestand.
-# We noemen het <adlibXML> om de structuur van de bron te benaderen.
-combined_root = ET.Element("adlibXML")
-# Maak een <recordList> aan binnen ons hoofdelement om alle records in te verzamelen
-record_list = ET.SubElement(combined_root, "recordList")
+# Gelijktijdig ophalen: aantal pagina's tegelijk onderweg
+CONCURRENCY = 4
+MAX_RETRIES = 3  # extra pogingen per pagina
+BACKOFF_SECONDS = 2  # wachttijd voor de eerste herhaling, verdubbelt per poging
 
-print(f"Starten met het ophalen van records... (limiet van {LIMIT} per keer)")
+# Ook een JSONL-bestand schrijven (één record per regel), naast de XML
+WRITE_JSONL = False
+JSONL_FILE = "../" + DATABASE + ".jsonl"
 
-while True:
-    # Stel de parameters voor deze specifieke aanvraag samen
+# Tussenbestanden: records worden direct naar PART_FILE geschreven; CHECKPOINT_FILE
+# onthoudt tot waar alles veilig op schijf staat, zodat een herstart daar verder gaat.
+PART_FILE = OUTPUT_FILE + ".part"
+CHECKPOINT_FILE = OUTPUT_FILE + ".checkpoint.json"
+
+
+def fetch_page(start_from):
+    """
+    Haalt één pagina op en geeft de <record> elementen terug (lege lijst = einde).
+    """
     params = {
         'database': DATABASE,
         'limit': LIMIT,
         'search': 'all',
-        'startfrom': START_FROM
+        'startfrom': start_from
     }
-
-    print(f"Ophalen van records... Start vanaf: {START_FROM}")
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = requests.get(BASE_URL, params=params, timeout=120)
+            response.raise_for_status()
+            # We gebruiken response.content om encoding-problemen te vermijden
+            page_root = ET.fromstring(response.content)
+            return page_root.findall(".//recordList/record")
+        except (requests.exceptions.RequestException, ET.ParseError) as e:
+            if attempt == MAX_RETRIES:
+                raise
+            wait = BACKOFF_SECONDS * 2 ** attempt
+            print(f"  ... fout bij startfrom={start_from} ({e}), nieuwe poging over {wait}s")
+            time.sleep(wait)
+
+
+def element_to_value(element):
+    """
+    Zet een XML-element om naar tekst of een dict; herhaalde velden worden lijsten.
+    """
+    children = list(element)
+    if not children:
+        value = (element.text or "").strip()
+        if element.attrib:
+            return {**element.attrib, "text": value} if value else dict(element.attrib)
+        return value
+    data = dict(element.attrib)
+    for child in children:
+        value = element_to_value(child)
+        if child.tag in data:
+            if not isinstance(data[child.tag], list):
+                data[child.tag] = [data[child.tag]]
+            data[child.tag].append(value)
+        else:
+            data[child.tag] = value
+    return data
+
+
+def load_checkpoint():
+    if os.path.exists(CHECKPOINT_FILE):
+        with open(CHECKPOINT_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"next_start_from": START_FROM, "records": 0, "part_size": 0, "jsonl_size": 0, "done": False}
+
+
+def save_checkpoint(state):
+    tmp = CHECKPOINT_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, CHECKPOINT_FILE)
+
+
+def open_truncated(path, size):
+    """
+    Opent path om verder te schrijven vanaf size (gooit half geschreven data na het checkpoint weg).
+    """
+    f = open(path, "ab")
+    f.truncate(size)
+    f.seek(size)
+    return f
+
+
+def write_output_file():
+    """
+    Zet het uiteindelijke XML-bestand in elkaar: kop + alle records + afsluiting.
+    """
+    with open(OUTPUT_FILE, "wb") as out, open(PART_FILE, "rb") as part:
+        out.write(b"<?xml version='1.0' encoding='utf-8'?>\n<adlibXML>\n  <recordList>\n")
+        shutil.copyfileobj(part, out)
+        out.write(b"  </recordList>\n</adlibXML>\n")
+
+
+def harvest():
+    state = load_checkpoint()
+    if state["done"]:
+        # Alles was al opgehaald, alleen het wegschrijven van de XML mislukte
+        finish(state)
+        return
+    if state["records"]:
+        print(f"Hervatten vanaf startfrom={state['next_start_from']} ({state['records']} records al binnen)")
+
+    print(f"Starten met het ophalen van records... (limiet van {LIMIT} per keer, {CONCURRENCY} tegelijk)")
+
+    part = open_truncated(PART_FILE, state["part_size"])
+    jsonl = open_truncated(JSONL_FILE, state["jsonl_size"]) if WRITE_JSONL else None
+    next_submit = state["next_start_from"]
+    in_flight = {}
 
     try:
-        # Voer de GET-request uit
-        response = requests.get(BASE_URL, params=params)
-        # Controleer op HTTP-fouten (bijv. 404, 500)
-        response.raise_for_status()
-
-        # Parse de XML-content van het antwoord
-        # We gebruiken response.content om encoding-problemen te vermijden
-        page_root = ET.fromstring(response.content)
-
-        # Zoek alle <record> elementen binnen de <recordList> van deze pagina
-        records_on_page = page_root.findall(".//recordList/record")
-
-        # Controleer of er records zijn gevonden
-        if not records_on_page:
-            # Geen records meer gevonden, dit is het einde
-            print("Geen records meer gevonden. Stoppen met ophalen.")
-            break
-
-        # Voeg elk gevonden record toe aan onze gecombineerde recordLijst
-        for record in records_on_page:
-            record_list.append(record)
-
-        print(f"  ... {len(records_on_page)} records toegevoegd. Totaal nu: {len(record_list)}")
-
-        # Verhoog de 'startfrom' parameter voor de volgende iteratie
-        START_FROM += LIMIT
-
-        # (Optioneel) Voeg een kleine pauze toe om de server niet te overbelasten
-        # time.sleep(0.5) # 0.5 seconden wachten
+        with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+            while True:
+                # Houd CONCURRENCY pagina's onderweg
+                while len(in_flight) < CONCURRENCY:
+                    in_flight[next_submit] = pool.submit(fetch_page, next_submit)
+                    next_submit += LIMIT
+
+                # Verwerk de pagina's strikt op volgorde
+                start_from = state["next_start_from"]
+                records_on_page = in_flight.pop(start_from).result()
+
+                if not records_on_page:
+                    print("Geen records meer gevonden. Stoppen met ophalen.")
+                    state["done"] = True
+                    save_checkpoint(state)
+                    break
+
+                for record in records_on_page:
+                    ET.indent(record, space="  ", level=2)
+                    record.tail = "\n"
+                    part.write(b"    " + ET.tostring(record, encoding="utf-8", xml_declaration=False))
+                    if jsonl:
+                        jsonl.write((json.dumps(element_to_value(record), ensure_ascii=False) + "\n").encode("utf-8"))
+
+                # Eerst data naar schijf, dan pas het checkpoint
+                part.flush()
+                os.fsync(part.fileno())
+                if jsonl:
+                    jsonl.flush()
+                    os.fsync(jsonl.fileno())
+                state["records"] += len(records_on_page)
+                state["next_start_from"] = start_from + LIMIT
+                state["part_size"] = part.tell()
+                state["jsonl_size"] = jsonl.tell() if jsonl else 0
+                save_checkpoint(state)
+
+                print(f"  ... {len(records_on_page)} records toegevoegd (startfrom={start_from}). "
+                      f"Totaal nu: {state['records']}")
+
+            for future in in_flight.values():
+                future.cancel()
 
     except requests.exceptions.RequestException as e:
         print(f"Fout tijdens het ophalen van data: {e}")
-        break
     except ET.ParseError as e:
         print(f"Fout tijdens het parsen van XML: {e}")
         print("Reactie van server was mogelijk geen valide XML.")
-        break
     except Exception as e:
         print(f"Een onverwachte fout is opgetreden: {e}")
-        break
+    finally:
+        part.close()
+        if jsonl:
+            jsonl.close()
 
-# Nadat de loop is voltooid (of afgebroken)
-print("\nOphalen voltooid.")
-print(f"Totaal {len(record_list)} records verzameld.")
-print(f"Gecombineerd bestand opslaan als '{OUTPUT_FILE}'...")
+    # Nadat de loop is voltooid (of afgebroken)
+    print(f"\nTotaal {state['records']} records verzameld.")
+    if not state["done"]:
+        print(f"Ophalen afgebroken. Start het script opnieuw om verder te gaan vanaf "
+              f"startfrom={state['next_start_from']}.")
+        return
 
-try:
-    # Maak een ElementTree object van ons gecombineerde hoofdelement
-    tree = ET.ElementTree(combined_root)
+    finish(state)
 
-    # Zorg voor mooie inspringing (pretty-print)
-    # Dit vereist Python 3.9+
-    ET.indent(tree, space="  ")
 
-    # Schrijf de boom naar een bestand, inclusief XML-declaratie en UTF-8 encoding
-    tree.write(OUTPUT_FILE, encoding='utf-8', xml_declaration=True)
-
-    print(f"Bestand '{OUTPUT_FILE}' succesvol aangemaakt.")
+def finish(state):
+    print(f"Gecombineerd bestand opslaan als '{OUTPUT_FILE}'...")
+    try:
+        write_output_file()
+        os.remove(PART_FILE)
+        os.remove(CHECKPOINT_FILE)
+        print(f"Bestand '{OUTPUT_FILE}' succesvol aangemaakt ({state['records']} records).")
+        if WRITE_JSONL:
+            print(f"Bestand '{JSONL_FILE}' succesvol aangemaakt.")
+    except Exception as e:
+        print(f"Fout tijdens het wegschrijven van het bestand: {e}")
 
-except Exception as e:
-    print(f"Fout tijdens het wegschrijven van het bestand: {e}")
\ No newline at end of file
+if __name__ == "__main__":
+    harvest()
@@ -1,8 +1,12 @@
 import requests
 import csv
+import json
 import os
+import threading
 import time
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 
 # --- Configuratie ---
 
@@ -12,9 +16,20 @@ CSV_FILE = 'images_NK_rest20260129.csv'  # Pas dit aan als je bestand anders hee
 # 2. De map waar de afbeeldingen worden opgeslagen
 DOWNLOAD_FOLDER = 'images_rest20260129'
 
-# 3. Wachttijd in seconden na elke download
+# 3. Wachttijd in seconden na elke download (alleen sequentiële modus)
 WAIT_TIME = 1
 
+# 4. Gelijktijdig downloaden (False = oude sequentiële modus)
+CONCURRENT = True
+MAX_WORKERS = 8  # aantal gelijktijdige downloads
+REQUESTS_PER_SECOND = 4  # maximum per host, vervangt de vaste WAIT_TIME
+MAX_RETRIES = 4  # extra pogingen bij timeouts, verbindingsfouten, 429 en 5xx
+BACKOFF_SECONDS = 2  # wachttijd voor de eerste herhaling, verdubbelt per poging
+CHUNK_SIZE = 64 * 1024
+
+# 5. Manifest met geslaagde en mislukte downloads (een herstart haalt alleen op wat ontbreekt)
+MANIFEST_FILE = os.path.join(DOWNLOAD_FOLDER, '_download_manifest.jsonl')
+
 
 # --- Einde Configuratie ---
 
@@ -122,6 +137,176 @@ def download_images():
     print("\n--- Script voltooid. ---")
 
 
+# --- Gelijktijdige modus ---
+
+class HostRateLimiter:
+    """
+    Laat per host hoogstens REQUESTS_PER_SECOND requests per seconde starten.
+    """
+
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second if per_second else 0.0
+        self.next_slot = {}
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        host = urllib.parse.urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+_thread_local = threading.local()
+
+
+def get_session():
+    """
+    Eén sessie per thread: hergebruikt keep-alive verbindingen naar dezelfde host.
+    """
+    session = getattr(_thread_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _thread_local.session = session
+    return session
+
+
+def guess_filename(url, response, item_number):
+    path = urllib.parse.urlparse(url).path
+    filename = os.path.basename(path)
+    if filename and '.' in filename:
+        return filename
+
+    # Probeer de extensie te raden op basis van de server response
+    content_type = response.headers.get('content-type') or ''
+    ext = '.jpg'  # Veilige gok
+    for mime, candidate in (('image/png', '.png'), ('image/gif', '.gif'),
+                            ('image/jpeg', '.jpg'), ('image/webp', '.webp')):
+        if mime in content_type:
+            ext = candidate
+    return f"image_{item_number}{ext}"
+
+
+def load_manifest():
+    """
+    Laatste resultaat per URL uit het manifest van eerdere runs.
+    """
+    entries = {}
+    if os.path.exists(MANIFEST_FILE):
+        with open(MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    entries[entry['url']] = entry
+                except (ValueError, KeyError):
+                    continue
+    return entries
+
+
+def is_verified(entry):
+    """
+    Een eerdere download telt als klaar als het bestand nog bestaat met de juiste grootte.
+    """
+    if not entry or entry.get('status') != 'ok':
+        return False
+    save_path = os.path.join(DOWNLOAD_FOLDER, entry['filename'])
+    return os.path.exists(save_path) and os.path.getsize(save_path) == entry['size']
+
+
+def download_one(url, item_number, limiter):
+    """
+    Downloadt één URL (gestreamd naar schijf) met herhalingen. Geeft een manifest-regel terug.
+    """
+    last_error = None
+    for attempt in range(MAX_RETRIES + 1):
+        if attempt:
+            time.sleep(BACKOFF_SECONDS * 2 ** (attempt - 1))
+        limiter.wait(url)
+        try:
+            with get_session().get(url, timeout=30, stream=True) as response:
+                if response.status_code == 429 or response.status_code >= 500:
+                    last_error = f"HTTP {response.status_code}"
+                    continue
+                response.raise_for_status()
+
+                filename = guess_filename(url, response, item_number)
+                save_path = os.path.join(DOWNLOAD_FOLDER, filename)
+                tmp_path = save_path + '.part'
+                size = 0
+                with open(tmp_path, 'wb') as img_file:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        img_file.write(chunk)
+                        size += len(chunk)
+
+                expected = response.headers.get('content-length')
+                if expected is not None and 'content-encoding' not in response.headers and int(expected) != size:
+                    os.remove(tmp_path)
+                    last_error = f"onvolledig: {size} van {expected} bytes"
+                    continue
+                os.replace(tmp_path, save_path)
+                return {'url': url, 'item': item_number, 'status': 'ok', 'filename': filename, 'size': size}
+
+        except requests.exceptions.HTTPError as e:
+            # 4xx (behalve 429): opnieuw proberen heeft geen zin
+            return {'url': url, 'item': item_number, 'status': 'failed',
+                    'error': f"HTTP {e.response.status_code}"}
+        except (requests.exceptions.RequestException, IOError) as e:
+            last_error = str(e)
+
+    return {'url': url, 'item': item_number, 'status': 'failed', 'error': last_error}
+
+
+def download_images_concurrent():
+    os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
+
+    try:
+        with open(CSV_FILE, mode='r', encoding='utf-8') as file:
+            reader = csv.DictReader(file)
+            if 'reproduction_url' not in reader.fieldnames:
+                print(f"FOUT: Het CSV-bestand '{CSV_FILE}' heeft geen kolom 'reproduction_url'.")
+                print(f"Gevonden headers: {reader.fieldnames}")
+                return
+            # (rijnummer in de CSV, url); rij 1 is de header
+            jobs = [(i + 2, row.get('reproduction_url', '').strip()) for i, row in enumerate(reader)]
+    except FileNotFoundError:
+        print(f"FOUT: Kan het bestand '{CSV_FILE}' niet vinden.")
+        return
+
+    jobs = [(row_number, url) for row_number, url in jobs if url.startswith('http')]
+    previous = load_manifest()
+    todo = [(row_number, url) for row_number, url in jobs if not is_verified(previous.get(url))]
+    todo = list(dict((url, (row_number, url)) for row_number, url in todo).values())  # dubbele URLs één keer
+    print(f"{len(jobs)} URLs, {len(jobs) - len(todo)} al aanwezig. {len(todo)} te downloaden "
+          f"met {MAX_WORKERS} threads, max {REQUESTS_PER_SECOND} requests/s per host.")
+
+    limiter = HostRateLimiter(REQUESTS_PER_SECOND)
+    n_ok = n_failed = 0
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool, \
+            open(MANIFEST_FILE, 'a', encoding='utf-8') as manifest:
+        futures = [pool.submit(download_one, url, row_number - 1, limiter) for row_number, url in todo]
+        for future in as_completed(futures):
+            entry = future.result()
+            manifest.write(json.dumps(entry) + '\n')
+            manifest.flush()
+            if entry['status'] == 'ok':
+                n_ok += 1
+            else:
+                n_failed += 1
+                print(f"  ... FOUT: {entry['url']}: {entry['error']}")
+            if (n_ok + n_failed) % 100 == 0:
+                print(f"{n_ok + n_failed}/{len(todo)} verwerkt ({n_failed} mislukt)")
+
+    print(f"\n--- Klaar: {n_ok} gedownload, {n_failed} mislukt (zie {MANIFEST_FILE}). ---")
+
+
 # Voer de hoofdfunctie uit
 if __name__ == "__main__":
-    download_images()
\ No newline at end of file
+    if CONCURRENT:
+        download_images_concurrent()
+    else:
+        download_images()
\ No newline at end of file
@@ -0,0 +1,156 @@
+import csv
+import os
+import zipfile
+import xml.etree.ElementTree as ET
+
+# Zet een Adlib XML-export (in een zip) om naar het invoerbestand van de matcher
+# (object_number, object_name, dimensions, reproduction.path), één regel per foto.
+#
+# De XML wordt direct uit de zip gestreamd met iterparse; elk <record> wordt na
+# verwerking weggegooid, dus het geheugengebruik hangt niet af van de grootte van
+# de export. Zowel de gegroepeerde export (NK_collectie.xml: <Dimension>,
+# <Reproduction>, ...) als de platte export (NK_eigenbeheer.xml) worden ondersteund.
+
+# --- Configuratie ---
+
+# 1. De zip met de XML-export (het eerste .xml-bestand in de zip wordt gebruikt)
+ZIP_FILE = 'NK_collectie.zip'
+
+# 2. Uitvoer: .csv, of .parquet (vereist pyarrow)
+OUTPUT_FILE = 'images_to_match_from_xml.csv'
+
+# 3. Map met de foto's, zoals die in reproduction.path moet komen (relatief t.o.v. de matcher)
+IMAGE_FOLDER = 'NK_collectie/images_remove_frame'
+
+# 4. Controleer in dezelfde doorloop of de foto's bestaan
+CHECK_FILES = True
+# Als een bijgesneden versie (<ref>_cropped.jpg) bestaat, die gebruiken
+PREFER_CROPPED = True
+# Regels zonder bestaand bestand weglaten (alleen met CHECK_FILES)
+ONLY_EXISTING = True
+
+# Pad vanaf waar IMAGE_FOLDER gecontroleerd wordt (de map van waaruit de matcher draait)
+BASE_DIR = '..'
+
+# --- Einde Configuratie ---
+
+FIELDS = ['object_number', 'object_name', 'dimensions', 'reproduction.path']
+PARQUET_BATCH_ROWS = 50000  # regels per Parquet row group
+
+
+def texts(record, path):
+    return [(el.text or '').strip() for el in record.iterfind(path)]
+
+
+def format_dimensions(record):
+    """
+    "hoogte 40 cm; breedte 74 cm" uit de dimension.type/value/unit velden.
+    """
+    parts = []
+    for dim_type, value, unit in zip(texts(record, './/dimension.type'),
+                                     texts(record, './/dimension.value'),
+                                     texts(record, './/dimension.unit')):
+        if value:
+            parts.append(" ".join(p for p in (dim_type, value, unit) if p))
+    return "; ".join(parts)
+
+
+def resolve_path(reference):
+    """
+    Geeft (reproduction.path, bestaat) voor een reproduction.reference.
+    """
+    candidates = [f"{reference}_cropped.jpg", f"{reference}.jpg"] if PREFER_CROPPED else [f"{reference}.jpg"]
+    if CHECK_FILES:
+        for name in candidates:
+            if os.path.exists(os.path.join(BASE_DIR, IMAGE_FOLDER, name)):
+                return f"{IMAGE_FOLDER}/{name}", True
+        return f"{IMAGE_FOLDER}/{reference}.jpg", False
+    return f"{IMAGE_FOLDER}/{reference}.jpg", None
+
+
+def iter_records(zip_path):
+    """
+    Streamt de <record> elementen uit de eerste XML in de zip.
+    """
+    with zipfile.ZipFile(zip_path) as z:
+        xml_name = next(n for n in z.namelist() if n.lower().endswith('.xml'))
+        print(f"Lezen van '{xml_name}' uit '{zip_path}'...")
+        with z.open(xml_name) as f:
+            parent = None
+            for event, el in ET.iterparse(f, events=('start', 'end')):
+                if event == 'start':
+                    if el.tag == 'recordList':
+                        parent = el
+                    continue
+                if el.tag == 'record':
+                    yield el
+                    # Record weggooien zodra het verwerkt is
+                    el.clear()
+                    if parent is not None:
+                        parent.remove(el)
+
+
+def iter_rows(zip_path, stats):
+    for record in iter_records(zip_path):
+        stats['records'] += 1
+        object_number = (record.findtext('.//object_number') or '').strip()
+        references = [r for r in texts(record, './/reproduction.reference') if r]
+        if not object_number or not references:
+            stats['no_images'] += 1
+            continue
+        names = [n for n in texts(record, './/object_name') if n]
+        object_name = names[0] if names else ''
+        dimensions = format_dimensions(record)
+
+        for reference in references:
+            path, exists = resolve_path(reference)
+            if exists is False:
+                stats['missing'] += 1
+                if ONLY_EXISTING:
+                    continue
+            stats['rows'] += 1
+            yield {'object_number': object_number, 'object_name': object_name,
+                   'dimensions': dimensions, 'reproduction.path': path}
+
+
+def write_parquet(rows, path):
+    """
+    Schrijft de regels in row groups van PARQUET_BATCH_ROWS, zodat ook hier het
+    geheugengebruik niet van de grootte van de export afhangt.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(field, pa.string()) for field in FIELDS])
+    with pq.ParquetWriter(path, schema) as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= PARQUET_BATCH_ROWS:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                batch = []
+        if batch:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+
+
+def convert():
+    stats = {'records': 0, 'no_images': 0, 'rows': 0, 'missing': 0}
+    rows = iter_rows(ZIP_FILE, stats)
+
+    if OUTPUT_FILE.endswith('.parquet'):
+        write_parquet(rows, OUTPUT_FILE)
+    else:
+        with open(OUTPUT_FILE, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS, quoting=csv.QUOTE_ALL)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    print(f"{stats['records']} records gelezen, {stats['no_images']} zonder objectnummer of foto's.")
+    print(f"{stats['rows']} regels geschreven naar '{OUTPUT_FILE}'.")
+    if CHECK_FILES:
+        action = "weggelaten" if ONLY_EXISTING else "wel opgenomen"
+        print(f"{stats['missing']} foto's niet gevonden in '{os.path.join(BASE_DIR, IMAGE_FOLDER)}' ({action}).")
+
+
+if __name__ == "__main__":
+    convert()
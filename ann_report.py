@@ -0,0 +1,155 @@
+# ann_report.py
+# Compares the approximate FAISS index types against the exact flat index.
+#
+# For every type in index_types.INDEX_TYPES the DHM vectors of the flat index are
+# indexed again and queried; the top-k ids are compared with the flat top-k.
+# Reported per type: recall@k, query latency, build time and index size.
+import json
+import os
+import time
+
+import faiss
+import numpy as np
+
+import index_sync
+import index_types
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+model_name = "facebook/dinov2-large"
+csv1_path = "NK_collectie/images_to_match.csv"
+dir2 = "DHM/DHM_images_split_yolo_detect"
+
+# Queries: "nk" embeds the NK images of csv1_path (cheap with the embedding cache),
+# "dhm_sample" uses a random sample of the indexed DHM vectors (no model needed)
+QUERY_SOURCE = "nk"
+N_SAMPLE_QUERIES = 1000
+K_VALUES = (1, 10, 100)
+EMBEDDING_CACHE_DIR = "embedding_cache"
+
+# Settings per index type to compare (name, index_type, build params, search params)
+CANDIDATES = [
+    ("ivf_flat", "ivf_flat", {}, {"nprobe": 8}),
+    ("ivf_flat_np32", "ivf_flat", {}, {"nprobe": 32}),
+    ("ivf_pq", "ivf_pq", {}, {"nprobe": 16}),
+    ("hnsw", "hnsw", {}, {"ef_search": 128}),
+    ("hnsw_ef256", "hnsw", {}, {"ef_search": 256}),
+]
+# -----------------------------
+
+config_name = model_name.split("/")[-1] + "_" + dir2.split("/")[-1]
+report_file = f"ann_report_{config_name}.json"
+
+
+def flat_vectors(index):
+    """
+    (vectors, ids) stored in the flat IndexIDMap2.
+    """
+    inner = faiss.downcast_index(index.index)
+    vectors = inner.reconstruct_n(0, inner.ntotal)
+    ids = faiss.vector_to_array(index.id_map).astype("int64")
+    return vectors, ids
+
+
+def nk_queries():
+    import pandas as pd
+    import torch
+
+    import embedding_engine
+    from embedding_cache import EmbeddingCache
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    processor, model = embedding_engine.load_model(model_name, device)
+    cache = EmbeddingCache(model_name, processor, cache_dir=EMBEDDING_CACHE_DIR)
+    df = pd.read_csv(csv1_path)
+    paths = [p for p in df["reproduction.path"].astype(str) if os.path.exists(p)]
+    embs = embedding_engine.compute_image_embeddings(paths, processor, model, device, cache=cache)
+    return embs[np.linalg.norm(embs, axis=1) > 0]
+
+
+def timed_search(index, queries, k):
+    t0 = time.perf_counter()
+    _, I = index.search(queries, k)
+    batch_s = time.perf_counter() - t0
+
+    # Single-query latency on a small subset (what the query service would see)
+    n_single = min(200, len(queries))
+    lat = []
+    for q in queries[:n_single]:
+        t1 = time.perf_counter()
+        index.search(q[None, :], k)
+        lat.append((time.perf_counter() - t1) * 1000)
+    return I, {
+        "batch_ms_per_query": round(batch_s * 1000 / len(queries), 4),
+        "single_ms_p50": round(float(np.percentile(lat, 50)), 4),
+        "single_ms_p95": round(float(np.percentile(lat, 95)), 4),
+    }
+
+
+def recall_at(I_ref, I, k):
+    hits = [len(set(a[:k]) & set(b[:k])) / k for a, b in zip(I_ref, I)]
+    return round(float(np.mean(hits)), 4)
+
+
+def main():
+    faiss_file, manifest_file = index_types.index_file_names(config_name, "flat")
+    flat, manifest = index_sync.load_index(faiss_file, manifest_file, header={"model_name": model_name})
+    if flat is None:
+        print(f"Error: flat index {faiss_file} not found. Run the matcher first.")
+        return
+    vectors, ids = flat_vectors(flat)
+    print(f"Flat index: {len(ids)} vectors, dim {vectors.shape[1]}")
+
+    if QUERY_SOURCE == "nk":
+        queries = nk_queries()
+    else:
+        rng = np.random.default_rng(0)
+        queries = vectors[rng.choice(len(vectors), min(N_SAMPLE_QUERIES, len(vectors)), replace=False)]
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    k_max = min(max(K_VALUES), len(ids))
+    print(f"{len(queries)} queries ({QUERY_SOURCE}), k={k_max}")
+
+    I_ref, flat_timing = timed_search(flat, queries, k_max)
+    results = [{
+        "name": "flat", "index_type": "flat",
+        "recall": {f"@{k}": 1.0 for k in K_VALUES if k <= k_max},
+        **flat_timing,
+        "build_s": None,
+        "size_mb": round(index_types.index_size_bytes(flat) / 1e6, 2),
+    }]
+
+    for name, index_type, build_params, search_params in CANDIDATES:
+        t0 = time.perf_counter()
+        index = index_types.build_index(index_type, vectors, ids, **build_params)
+        build_s = time.perf_counter() - t0
+        index_types.set_search_params(index, **search_params)
+        I, timing = timed_search(index, queries, k_max)
+        results.append({
+            "name": name, "index_type": index_type,
+            "build_params": build_params, "search_params": search_params,
+            "recall": {f"@{k}": recall_at(I_ref, I, k) for k in K_VALUES if k <= k_max},
+            **timing,
+            "build_s": round(build_s, 2),
+            "size_mb": round(index_types.index_size_bytes(index) / 1e6, 2),
+        })
+
+    print(f"\n{'name':<16}{'recall':<32}{'ms/query':>10}{'p50 ms':>10}{'size MB':>10}")
+    for r in results:
+        recall = " ".join(f"{k}={v:.3f}" for k, v in r["recall"].items())
+        print(f"{r['name']:<16}{recall:<32}{r['batch_ms_per_query']:>10}{r['single_ms_p50']:>10}{r['size_mb']:>10}")
+
+    with open(report_file, "w", encoding="utf-8") as f:
+        json.dump({
+            "config": config_name,
+            "n_vectors": int(len(ids)),
+            "n_queries": int(len(queries)),
+            "query_source": QUERY_SOURCE,
+            "k": k_max,
+            "results": results,
+        }, f, indent=2)
+    print(f"\n✓ Report written to {report_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# base_search.py
+# Collapses search results to one hit per DHM base inventory number.
+#
+# A DHM record appears as the original scan plus its YOLO crops (<base>_0.jpg,
+# <base>_0_1.jpg, ...), so a plain top-k is often filled with crops of one record.
+# Grouped search over-fetches from FAISS, keeps the best-ranked image per base and
+# returns the top-k distinct bases. The grouping runs on a precomputed id -> base
+# array, fully in numpy.
+import numpy as np
+
+import index_sync
+
+OVERFETCH = 5  # FAISS results fetched per requested distinct base
+
+
+def base_id_array(idx_to_path):
+    """
+    Returns (base_ids, base_names): base_ids[faiss_id] is the number of the DHM base
+    in base_names (-1 for ids not in use).
+    """
+    base_names = sorted({index_sync.dhm_base(p) for p in idx_to_path.values()})
+    number = {b: n for n, b in enumerate(base_names)}
+    base_ids = np.full(max(idx_to_path, default=-1) + 1, -1, dtype="int64")
+    for idx, path in idx_to_path.items():
+        base_ids[idx] = number[index_sync.dhm_base(path)]
+    return base_ids, base_names
+
+
+def collapse_by_base(D, I, base_ids, k):
+    """
+    Keeps, per row, the first (best-ranked) result of every base and returns the
+    first k of those as (D, I) of shape (n, k), padded with -1 ids.
+    """
+    n, m = I.shape
+    valid = I >= 0
+    bases = np.where(valid, base_ids[np.where(valid, I, 0)], -1).ravel()
+    rows = np.repeat(np.arange(n), m)
+    ranks = np.tile(np.arange(m), n)
+
+    # Sort by (row, base, rank): the first entry of each (row, base) run is its best hit
+    order = np.lexsort((ranks, bases, rows))
+    r_sorted, b_sorted = rows[order], bases[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (r_sorted[1:] != r_sorted[:-1]) | (b_sorted[1:] != b_sorted[:-1])
+    keep = np.zeros(n * m, dtype=bool)
+    keep[order[first]] = True
+    keep = (keep & (bases >= 0)).reshape(n, m)
+
+    # Position of each kept hit among the kept hits of its row (still in rank order)
+    pos = np.cumsum(keep, axis=1) - 1
+    r_idx, c_idx = np.nonzero(keep & (pos < k))
+    out_I = np.full((n, k), -1, dtype="int64")
+    out_D = np.zeros((n, k), dtype=D.dtype)
+    out_I[r_idx, pos[r_idx, c_idx]] = I[r_idx, c_idx]
+    out_D[r_idx, pos[r_idx, c_idx]] = D[r_idx, c_idx]
+    return out_D, out_I
+
+
+def fetch_k(k, ntotal, overfetch=OVERFETCH):
+    """
+    No of FAISS results to request for k distinct bases.
+    """
+    return min(k * overfetch, ntotal)
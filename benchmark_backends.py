@@ -0,0 +1,156 @@
+# benchmark_backends.py
+# Compares the inference backends of inference_backends.py with eager fp32.
+#
+# Per backend:
+#   - images/sec on a fixed sample of DHM images (after one warm-up batch)
+#   - cosine agreement of its embeddings with the eager fp32 embeddings (mean / min / p1)
+#   - GT recall@1/10/100 + MRR when the ground-truth queries are embedded with the
+#     backend and searched in the eager flat index of the matcher (query-side effect).
+#     For the full effect (DHM set embedded with the backend too) run
+#     python evaluate.py --set inference_backend=<backend>.
+#
+# Example:
+#   python benchmark_backends.py --backends eager int8 onnx --n-images 256
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+import evaluate
+import index_sync
+import index_types
+from inference_backends import BACKENDS, cosine_agreement
+
+
+def sample_images(folder, n, seed=0):
+    paths = index_sync.list_image_files(folder)
+    rng = np.random.default_rng(seed)
+    return sorted(rng.choice(paths, min(n, len(paths)), replace=False).tolist())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the DINO inference backends against eager fp32")
+    parser.add_argument("--model", default="facebook/dinov2-large")
+    parser.add_argument("--dir2", default="DHM/DHM_images_split_yolo_detect")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--n-images", type=int, default=256, help="DHM images for speed + cosine agreement")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--gt", default=evaluate.GT_CSV)
+    parser.add_argument("--gt-matches", default=evaluate.GT_MATCHES_CSV)
+    parser.add_argument("--search-k", type=int, default=1000)
+    parser.add_argument("--no-gt", action="store_true", help="skip the ground-truth recall")
+    parser.add_argument("--report", default=None)
+    args = parser.parse_args()
+
+    import torch
+
+    import embedding_engine
+
+    config_name = args.model.split("/")[-1] + "_" + os.path.basename(os.path.normpath(args.dir2))
+    report_file = args.report or f"backend_report_{config_name}.json"
+    device = "cpu"  # the backends are meant for CPU runs
+    print(f"torch {torch.__version__}, {torch.get_num_threads()} threads")
+
+    sample = sample_images(args.dir2, args.n_images)
+    print(f"Speed / agreement sample: {len(sample)} images from {args.dir2}")
+
+    # Ground truth against the eager flat index of the matcher
+    gt = None
+    if not args.no_gt:
+        faiss_file, manifest_file = index_types.index_file_names(config_name, "flat")
+        index, manifest = index_sync.load_index(faiss_file, manifest_file, header={"model_name": args.model})
+        if index is None:
+            print(f"Warning: no flat index {faiss_file}; skipping GT recall (run the matcher first).")
+        else:
+            try:
+                photos, truth = evaluate.load_ground_truth(args.gt, args.gt_matches)
+            except ValueError as e:
+                print(f"Warning: {e}; skipping GT recall.")
+            else:
+                base_of_id = {idx: index_sync.dhm_base(p) for idx, p in index_sync.idx_to_path_of(manifest).items()}
+                gt = (index, photos, truth, base_of_id)
+                print(f"Ground truth: {len(photos)} photos, index {faiss_file} ({index.ntotal} vectors)")
+
+    # eager first: it is the reference for the others
+    backends = ["eager"] + [b for b in args.backends if b != "eager"]
+    results = []
+    for backend in backends:
+        print(f"\n=== {backend} ===")
+        try:
+            t0 = time.perf_counter()
+            processor, model = embedding_engine.load_model(args.model, device, backend=backend)
+
+            def embed(paths, desc):
+                return embedding_engine.compute_image_embeddings(
+                    paths, processor, model, device,
+                    batch_size=args.batch_size, num_workers=args.workers, desc=desc)
+
+            # Warm-up (torch.compile / ONNX Runtime do their work on the first call)
+            embed(sample[:args.batch_size], "Warm-up")
+            load_s = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            embs = embed(sample, f"{backend}")
+            elapsed = time.perf_counter() - t0
+        except Exception as e:
+            if backend == "eager":
+                # Without the reference there is no agreement or speedup to report
+                print(f"Error: the eager reference backend failed: {e}")
+                sys.exit(1)
+            print(f"Backend {backend} failed: {e}")
+            results.append({"backend": backend, "error": str(e)})
+            continue
+
+        if backend == "eager":
+            reference = embs
+        cos = cosine_agreement(reference, embs)
+        result = {
+            "backend": backend,
+            "load_and_warmup_s": round(load_s, 2),
+            "images_per_sec": round(len(sample) / elapsed, 2),
+            "cosine_mean": round(float(cos.mean()), 6),
+            "cosine_min": round(float(cos.min()), 6),
+            "cosine_p1": round(float(np.percentile(cos, 1)), 6),
+        }
+
+        if gt is not None:
+            index, photos, truth, base_of_id = gt
+            queries = embed([p for _, p in photos], "GT queries")
+            D, I = index.search(np.ascontiguousarray(queries, dtype="float32"), min(args.search_k, index.ntotal))
+            result["gt"] = evaluate.retrieval_metrics(
+                list(evaluate.first_hit_ranks(photos, truth, D, I, base_of_id).values()))
+        results.append(result)
+
+        del model
+        gc.collect()
+
+    print(f"\n{'backend':<10}{'img/s':>8}{'speedup':>9}{'cos mean':>10}{'cos min':>10}{'R@1':>7}{'R@10':>7}{'MRR':>7}")
+    eager_rate = results[0]["images_per_sec"]
+    for r in results:
+        if "error" in r:
+            print(f"{r['backend']:<10}  failed: {r['error']}")
+            continue
+        speedup = r["images_per_sec"] / eager_rate
+        m = r.get("gt", {})
+        print(f"{r['backend']:<10}{r['images_per_sec']:>8}{speedup:>8.2f}x{r['cosine_mean']:>10.4f}{r['cosine_min']:>10.4f}"
+              f"{m.get('recall@1', ''):>7}{m.get('recall@10', ''):>7}{m.get('mrr', ''):>7}")
+
+    with open(report_file, "w", encoding="utf-8") as f:
+        json.dump({
+            "model_name": args.model,
+            "torch_version": torch.__version__,
+            "num_threads": torch.get_num_threads(),
+            "n_images": len(sample),
+            "batch_size": args.batch_size,
+            "results": results,
+        }, f, indent=2)
+    print(f"\n✓ Report written to {report_file}")
+
+
+if __name__ == "__main__":
+    main()
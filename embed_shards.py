@@ -0,0 +1,285 @@
+# embed_shards.py
+# Embeds the DHM image folder (dir2) as a sharded job: several worker processes per
+# machine, and optionally several machines working on one job folder on a shared
+# filesystem. The result is the same FAISS index + manifest the matcher builds, so
+# nk_matcher.py index / compare_images_DINO_v4-2.py afterwards only adds what changed.
+#
+#   plan     list the images and split them into --shards shards; an image's shard
+#            follows from the hash of its path, so the split is the same on every
+#            machine and adding images doesn't move the others
+#   run      embed the shards that aren't done yet in --processes worker processes
+#            with --threads torch threads each; --node K/N takes every N-th shard
+#            (starting at K), so N machines can share a job without coordination
+#   status   done / missing shards
+#   merge    all shards -> <index_config>.emb store + FAISS index + manifest
+#
+# Job folder:
+#   job.json                    settings (nk_matcher config), index header, no of shards
+#   shard_0000.paths.txt        input: the images of the shard
+#   shard_0000.files.json       output: size, mtime and sha1 per image (for the manifest)
+#   shard_0000.emb.*            output: embedding store (see embedding_store.py); its
+#                               .json header is written last and marks the shard as done
+# A shard that failed or was interrupted is simply run again; with the embedding cache
+# (embedding_cache_dir) its images that did get embedded are not embedded twice.
+#
+# Example (2 machines, 4 processes of 4 threads each):
+#   python embed_shards.py plan --job jobs/dhm --shards 64 --config my_config.json
+#   python embed_shards.py run --job jobs/dhm --processes 4 --threads 4 --node 0/2   # machine 1
+#   python embed_shards.py run --job jobs/dhm --processes 4 --threads 4 --node 1/2   # machine 2
+#   python embed_shards.py merge --job jobs/dhm
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import embedding_store
+import nk_matcher
+
+JOB_FILE = "job.json"
+
+
+def shard_of(path, n_shards):
+    return int(hashlib.sha1(path.encode("utf-8")).hexdigest()[:8], 16) % n_shards
+
+
+def shard_prefix(job_dir, shard):
+    return os.path.join(job_dir, f"shard_{shard:04d}")
+
+
+def load_job(job_dir):
+    with open(os.path.join(job_dir, JOB_FILE), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def shard_done(job_dir, shard):
+    return embedding_store.store_exists(shard_prefix(job_dir, shard) + ".emb")
+
+
+def plan(job_dir, config, n_shards):
+    import image_loader
+    import index_sync
+    import inference_backends
+    from embedding_cache import preprocessing_signature
+    from transformers import AutoImageProcessor
+
+    if os.path.exists(os.path.join(job_dir, JOB_FILE)):
+        raise RuntimeError(f"{job_dir} already has a job; use a new folder")
+    os.makedirs(job_dir, exist_ok=True)
+    paths = index_sync.list_image_files(config["dir2"])
+    shards = [[] for _ in range(n_shards)]
+    for path in paths:
+        shards[shard_of(path, n_shards)].append(path)
+    for shard, shard_paths in enumerate(shards):
+        with open(shard_prefix(job_dir, shard) + ".paths.txt", "w", encoding="utf-8") as f:
+            f.write("\n".join(shard_paths))
+
+    processor = AutoImageProcessor.from_pretrained(config["model_name"])
+    # Same settings as Matcher.model(), so the matcher accepts the merged index
+    settings = image_loader.merge_settings(inference_backends.backend_settings(config["inference_backend"]),
+                                           image_loader.loader_settings(config["image_loader"]))
+    header = {"model_name": config["model_name"], "index_type": config["index_type"],
+              "preprocessing": preprocessing_signature(processor, settings), "folder": config["dir2"]}
+    with open(os.path.join(job_dir, JOB_FILE), "w", encoding="utf-8") as f:
+        json.dump({"config": config, "header": header, "n_shards": n_shards, "n_images": len(paths),
+                   "created": time.strftime("%Y-%m-%d %H:%M:%S")}, f, indent=2)
+    sizes = [len(s) for s in shards]
+    print(f"Planned {len(paths)} images in {n_shards} shards ({min(sizes)}-{max(sizes)} images each) in {job_dir}")
+
+
+# -----------------------------
+# Worker processes
+# -----------------------------
+
+_matcher = None
+
+
+def _init_worker(config, threads):
+    global _matcher
+    import torch
+
+    if threads:
+        torch.set_num_threads(threads)
+    _matcher = nk_matcher.Matcher(config)
+
+
+def _embed_shard(job_dir, shard):
+    """
+    Embeds one shard in a worker process. Returns (shard, no of images, no failed, seconds).
+    """
+    import numpy as np
+
+    from embedding_cache import sha1_of_file
+
+    t0 = time.perf_counter()
+    prefix = shard_prefix(job_dir, shard)
+    if embedding_store.store_exists(prefix + ".emb"):
+        os.remove(prefix + ".emb.json")  # --force: not done until rewritten
+    with open(prefix + ".paths.txt", "r", encoding="utf-8") as f:
+        paths = [p for p in f.read().split("\n") if p]
+    embs = _matcher.compute_image_embeddings(paths)
+    cache = _matcher.embedding_cache
+    file_hash = cache.file_hash if cache else sha1_of_file
+    ok = np.linalg.norm(embs, axis=1) > 0
+    files = {}
+    for path, good in zip(paths, ok):
+        if good:
+            st = os.stat(path)
+            files[path] = [st.st_size, st.st_mtime_ns, file_hash(path)]
+    if cache:
+        cache.save()
+    with open(prefix + ".files.json", "w", encoding="utf-8") as f:
+        json.dump(files, f)
+    # Store header last: the shard counts as done only when everything is written
+    embedding_store.write_store(prefix + ".emb", paths, np.arange(len(paths)), embs,
+                                model_name=_matcher.config["model_name"], variants=("float32",))
+    return shard, len(paths), int((~ok).sum()), time.perf_counter() - t0
+
+
+def run(job_dir, shards=None, node=(0, 1), processes=1, threads=None, force=False):
+    job = load_job(job_dir)
+    k, n = node
+    shards = range(job["n_shards"]) if shards is None else shards
+    todo = [s for s in shards if s % n == k and (force or not shard_done(job_dir, s))]
+    print(f"{len(todo)} shards to embed with {processes} processes x {threads or 'default'} threads")
+    if not todo:
+        return []
+
+    failed = []
+    # spawn: torch and forked worker processes don't mix
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_init_worker,
+                             initargs=(job["config"], threads)) as pool:
+        jobs = {pool.submit(_embed_shard, job_dir, s): s for s in todo}
+        for done, future in enumerate(as_completed(jobs), 1):
+            try:
+                shard, n_images, n_failed, seconds = future.result()
+                print(f"[{done}/{len(todo)}] shard {shard}: {n_images} images in {seconds:.0f}s "
+                      f"({n_images / max(seconds, 1e-9):.1f} images/sec)" + (f", {n_failed} failed" if n_failed else ""))
+            except Exception as e:
+                failed.append(jobs[future])
+                print(f"[{done}/{len(todo)}] shard {jobs[future]} failed: {e}")
+    if failed:
+        print(f"Failed shards: {' '.join(map(str, sorted(failed)))}; rerun them with "
+              f"python embed_shards.py run --job {job_dir} --shards {' '.join(map(str, sorted(failed)))}")
+    return failed
+
+
+def status(job_dir):
+    job = load_job(job_dir)
+    missing = [s for s in range(job["n_shards"]) if not shard_done(job_dir, s)]
+    print(f"{job['n_shards'] - len(missing)}/{job['n_shards']} shards done ({job['n_images']} images)")
+    if missing:
+        print(f"Missing: {' '.join(map(str, missing))}")
+    return missing
+
+
+# -----------------------------
+# Merge
+# -----------------------------
+
+def merge(job_dir, variants=None):
+    """
+    Writes the DHM embedding store, FAISS index and manifest of the job's config from the shards.
+    Images that failed in their shard are left out (the next index sync retries them).
+    """
+    import numpy as np
+
+    import index_sync
+    import index_types
+
+    job = load_job(job_dir)
+    if status(job_dir):
+        raise RuntimeError("Not all shards are done; run them first")
+    config = job["config"]
+    matcher = nk_matcher.Matcher(config)
+    variants = tuple(variants or config["store_variants"] or ("float32",))
+    if "float32" not in variants:
+        variants = ("float32",) + variants  # the index is built from the float32 copy
+
+    paths, files, blocks = [], {}, []
+    for shard in range(job["n_shards"]):
+        prefix = shard_prefix(job_dir, shard)
+        store = embedding_store.EmbeddingStore(prefix + ".emb")
+        with open(prefix + ".files.json", "r", encoding="utf-8") as f:
+            shard_files = json.load(f)
+        rows = [i for i, p in enumerate(store.paths) if p in shard_files]
+        paths += [store.paths[i] for i in rows]
+        files.update(shard_files)
+        blocks.append(store.rows(np.asarray(rows, dtype="int64")))
+    embs = np.concatenate(blocks) if blocks else np.zeros((0, 0), dtype="float32")
+    print(f"Merging {len(paths)} embeddings from {job['n_shards']} shards "
+          f"({job['n_images'] - len(paths)} images failed)")
+
+    store_prefix = matcher.index_config + ".emb"
+    ids = np.arange(len(paths), dtype="int64")
+    embedding_store.write_store(store_prefix, paths, ids, embs, model_name=config["model_name"], variants=variants)
+    del embs, blocks
+    index = index_types.build_index_from_store(config["index_type"], embedding_store.EmbeddingStore(store_prefix))
+
+    manifest = index_sync.new_manifest(config["index_type"], job["header"])
+    for idx, path in enumerate(paths):
+        size, mtime_ns, sha1 = files[path]
+        manifest["files"][path] = {"id": idx, "size": size, "mtime_ns": mtime_ns, "sha1": sha1}
+    manifest["next_id"] = len(paths)
+    faiss_index_file, manifest_file = index_types.index_file_names(matcher.index_config, config["index_type"])
+    index_sync.save_index(index, manifest, faiss_index_file, manifest_file)
+    print(f"✓ Index written: {faiss_index_file} ({index.ntotal} vectors), {manifest_file}, {store_prefix}.*")
+
+
+def parse_node(text):
+    k, _, n = text.partition("/")
+    k, n = int(k), int(n or 1)
+    if not 0 <= k < n:
+        raise argparse.ArgumentTypeError("--node expects K/N with 0 <= K < N")
+    return k, n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded multi-process / multi-machine embedding of the DHM folder")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("plan", help="split the images of dir2 into shards")
+    p.add_argument("--job", required=True, help="job folder (on a shared filesystem for several machines)")
+    p.add_argument("--shards", type=int, default=32)
+    p.add_argument("--config", action="append", default=[], metavar="JSON", help="nk_matcher settings")
+    p.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", dest="overrides")
+
+    p = commands.add_parser("run", help="embed the shards that aren't done yet")
+    p.add_argument("--job", required=True)
+    p.add_argument("--shards", type=int, nargs="+", default=None, help="only these shards")
+    p.add_argument("--node", type=parse_node, default=(0, 1), metavar="K/N", help="every N-th shard, from K")
+    p.add_argument("--processes", type=int, default=1)
+    p.add_argument("--threads", type=int, default=None, help="torch threads per process")
+    p.add_argument("--force", action="store_true", help="also redo shards that are done")
+
+    p = commands.add_parser("status", help="done / missing shards")
+    p.add_argument("--job", required=True)
+
+    p = commands.add_parser("merge", help="build the index + manifest from all shards")
+    p.add_argument("--job", required=True)
+    p.add_argument("--store-variants", nargs="+", default=None, choices=embedding_store.VARIANTS)
+    args = parser.parse_args()
+
+    try:
+        if args.command == "plan":
+            try:
+                config = nk_matcher.load_config(args.config, args.overrides)
+            except (OSError, ValueError) as e:
+                parser.error(str(e))
+            plan(args.job, config, args.shards)
+        elif args.command == "run":
+            run(args.job, args.shards, args.node, args.processes, args.threads, args.force)
+        elif args.command == "status":
+            status(args.job)
+        else:
+            merge(args.job, args.store_variants)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+# embedding_cache.py
+# On-disk store of image embeddings, keyed by file content hash.
+#
+# Layout:
+#   <cache_dir>/file_hashes.json            path -> [size, mtime_ns, sha1]  (shared by all models)
+#   <cache_dir>/<namespace>/<run>.npy       float32 embeddings written by one run
+#   <cache_dir>/<namespace>/<run>.keys      content hashes, one per row of <run>.npy
+#
+# The namespace combines model_name with a hash of the preprocessing settings, so
+# switching model or processor config never returns stale vectors. Every run that
+# embeds new images adds one .npy/.keys pair; nothing is rewritten in place.
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+CACHE_DIR = "embedding_cache"
+
+
+def sha1_of_file(path, chunk_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def preprocessing_signature(processor, extra=None):
+    """
+    Stable short hash of the image processor settings (+ optional extra settings).
+    """
+    try:
+        settings = processor.to_dict()
+    except AttributeError:
+        settings = dict(getattr(processor, "__dict__", {}))
+    if extra:
+        settings = {"processor": settings, "extra": extra}
+    blob = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()[:12]
+
+
+class FileHashIndex:
+    """
+    Remembers content hashes by (path, size, mtime) so unchanged files are not re-read.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.file = os.path.join(cache_dir, "file_hashes.json")
+        self.entries = {}
+        self.dirty = False
+        if os.path.exists(self.file):
+            with open(self.file, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def get(self, path):
+        """
+        Returns the sha1 of the file content, or None if the file can't be read.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        entry = self.entries.get(path)
+        if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            return entry[2]
+        try:
+            digest = sha1_of_file(path)
+        except OSError as e:
+            print(f"Error hashing {path}: {e}")
+            return None
+        self.entries[path] = [st.st_size, st.st_mtime_ns, digest]
+        self.dirty = True
+        return digest
+
+    def remember(self, path, digest):
+        """
+        Records the hash of a file we just wrote ourselves, so it isn't read back.
+        """
+        st = os.stat(path)
+        self.entries[path] = [st.st_size, st.st_mtime_ns, digest]
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.file) or ".", exist_ok=True)
+        # Per-process temp file: several processes may share the cache (see embed_shards.py)
+        tmp = f"{self.file}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.file)
+        self.dirty = False
+
+
+class EmbeddingCache:
+    """
+    Embedding store for one (model_name, preprocessing settings) combination.
+    hashes: a FileHashIndex to share with another cache (default: the one in cache_dir).
+    """
+
+    def __init__(self, model_name, processor, cache_dir=CACHE_DIR, extra=None, dtype="float32", hashes=None):
+        self.model_name = model_name
+        self.dtype = dtype  # storage type of new shards (rows are always returned as float32)
+        self.signature = preprocessing_signature(processor, extra)
+        self.namespace = model_name.split("/")[-1] + "_" + self.signature
+        self.dir = os.path.join(cache_dir, self.namespace)
+        os.makedirs(self.dir, exist_ok=True)
+        self.hashes = hashes or FileHashIndex(cache_dir)
+        self._rows = {}    # content hash -> (shard no, row)
+        self._shards = []  # memory-mapped embedding arrays
+        self._load()
+
+    def _load(self):
+        for name in sorted(os.listdir(self.dir)):
+            if not name.endswith(".keys"):
+                continue
+            npy = os.path.join(self.dir, name[:-5] + ".npy")
+            if not os.path.exists(npy):
+                continue
+            with open(os.path.join(self.dir, name), "r", encoding="utf-8") as f:
+                keys = f.read().split()
+            arr = np.load(npy, mmap_mode="r")
+            if len(keys) != arr.shape[0]:
+                print(f"Warning: skipping inconsistent cache shard {npy}")
+                continue
+            shard = len(self._shards)
+            self._shards.append(arr)
+            for row, key in enumerate(keys):
+                self._rows[key] = (shard, row)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def file_hash(self, path):
+        return self.hashes.get(path)
+
+    def get_many(self, keys):
+        """
+        Returns a (len(keys), dim) float32 array. All keys must be present.
+        """
+        return np.vstack([self._shards[s][r] for s, r in (self._rows[k] for k in keys)]).astype("float32")
+
+    def put_many(self, keys, embs):
+        """
+        Stores embs (one row per key) as a new shard.
+        """
+        new = [(k, i) for i, k in enumerate(keys) if k not in self._rows]
+        if not new:
+            return
+        rows = np.ascontiguousarray(embs[[i for _, i in new]], dtype=self.dtype)
+        run = f"{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}_{len(self._shards)}"
+        npy = os.path.join(self.dir, run + ".npy")
+        np.save(npy, rows)
+        # Keys file last: a shard only counts once both files are complete
+        tmp = os.path.join(self.dir, run + ".keys.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("\n".join(k for k, _ in new))
+        os.replace(tmp, os.path.join(self.dir, run + ".keys"))
+        shard = len(self._shards)
+        self._shards.append(np.load(npy, mmap_mode="r"))
+        for row, (k, _) in enumerate(new):
+            self._rows[k] = (shard, row)
+
+    def save(self):
+        self.hashes.save()
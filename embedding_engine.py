@@ -0,0 +1,201 @@
+# embedding_engine.py
+# Batched image embedding for the DINO matcher.
+#
+# Decoding and preprocessing run in a pool of worker threads (PIL and the HF
+# image processor spend most of their time in C code and release the GIL).
+# Finished batches are put on a bounded prefetch queue; the main thread takes
+# them off and runs one model forward pass per batch.
+#
+# Stage times (decode, preprocess, wait_for_batch, forward) go to the active
+# pipeline_stats.RunStats, if there is one.
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+from tqdm import tqdm
+
+import pipeline_stats
+
+# Defaults, can be overridden per call
+BATCH_SIZE = 16        # images per forward pass
+NUM_WORKERS = 4        # decode + preprocess threads
+PREFETCH_BATCHES = 4   # max no of prepared batches waiting for the model
+
+
+def load_model(model_name, device, backend="eager"):
+    """
+    Loads the image processor and model for model_name and puts the model in eval mode.
+    backend selects the inference backend (see inference_backends.py).
+    """
+    from transformers import AutoImageProcessor, AutoModel
+
+    processor = AutoImageProcessor.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).to(device)
+    model.eval()
+    if backend != "eager":
+        import inference_backends
+
+        model = inference_backends.wrap_model(model, backend, processor, model_name, device)
+    return processor, model
+
+
+def prepare_image(processor, source, loader=None):
+    """
+    Decodes and preprocesses one image (a file path or an in-memory PIL image).
+    Returns a CHW float32 array, or None on failure. loader is an optional
+    image_loader.ImageLoader (draft JPEG decoding, pixel cache).
+    """
+    try:
+        if loader is not None:
+            return loader.prepare(source)
+        with pipeline_stats.timed("decode", items=1):
+            img = source if isinstance(source, Image.Image) else Image.open(source)
+            img = img.convert("RGB")
+        with pipeline_stats.timed("preprocess", items=1):
+            inputs = processor(images=img, return_tensors="np")
+        return inputs["pixel_values"][0]
+    except Exception as e:
+        print(f"Error processing {source if isinstance(source, str) else 'image'}: {e}")
+        return None
+
+
+def _batch_producer(paths, processor, batch_size, num_workers, out_queue, stop_event, loader=None):
+    """
+    Fills out_queue with (start, rows, pixel_values) tuples, in input order.
+    rows are the positions (relative to start) of the images that decoded successfully.
+    A final None marks the end of the stream.
+    """
+    try:
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            for start in range(0, len(paths), batch_size):
+                if stop_event.is_set():
+                    break
+                batch_paths = paths[start:start + batch_size]
+                arrays = list(pool.map(lambda p: prepare_image(processor, p, loader), batch_paths))
+                rows = [j for j, a in enumerate(arrays) if a is not None]
+                pixel_values = np.stack([arrays[j] for j in rows]) if rows else None
+                out_queue.put((start, rows, pixel_values))
+    finally:
+        out_queue.put(None)
+
+
+def embed_pixel_values(model, pixel_values, device):
+    """
+    One forward pass over a (B, C, H, W) batch. Returns L2-normalised mean-pooled
+    embeddings as a float32 numpy array of shape (B, hidden_size).
+    """
+    with torch.no_grad():
+        inputs = torch.from_numpy(pixel_values).to(device)
+        outputs = model(pixel_values=inputs)
+        emb = outputs.last_hidden_state.mean(dim=1)
+        emb = emb / emb.norm(dim=-1, keepdim=True)
+    return emb.float().cpu().numpy()
+
+
+def compute_image_embeddings(image_paths, processor, model, device,
+                             batch_size=BATCH_SIZE, num_workers=NUM_WORKERS,
+                             prefetch_batches=PREFETCH_BATCHES, desc="Embedding images",
+                             cache=None, embed_fn=embed_pixel_values, dim=None, loader=None):
+    """
+    Embeds image_paths in batches. The result has exactly one row per input path
+    (row i belongs to image_paths[i]); images that fail to load get an all-zero row.
+    Entries may also be in-memory PIL images (only without cache).
+    With an EmbeddingCache (see embedding_cache.py) only unseen images go through the model.
+    embed_fn(model, pixel_values, device) -> (B, dim) array computes the rows; dim
+    defaults to the model's hidden size (see patch_rerank.py for another embed_fn).
+    loader: optional image_loader.ImageLoader for decoding.
+    """
+    image_paths = list(image_paths)
+    if cache is not None:
+        return _compute_with_cache(image_paths, processor, model, device, cache,
+                                   batch_size=batch_size, num_workers=num_workers,
+                                   prefetch_batches=prefetch_batches, desc=desc,
+                                   embed_fn=embed_fn, dim=dim, loader=loader)
+    dim = dim or model.config.hidden_size
+    embs = np.zeros((len(image_paths), dim), dtype="float32")
+    if not image_paths:
+        return embs
+
+    batch_queue = queue.Queue(maxsize=max(1, prefetch_batches))
+    stop_event = threading.Event()
+    producer = threading.Thread(
+        target=_batch_producer,
+        args=(image_paths, processor, batch_size, num_workers, batch_queue, stop_event, loader),
+        daemon=True,
+    )
+
+    t0 = time.perf_counter()
+    n_done = 0
+    n_failed = 0
+    producer.start()
+    try:
+        with tqdm(total=len(image_paths), desc=desc) as pbar:
+            while True:
+                # Time spent here = the model waiting for decoding / preprocessing
+                with pipeline_stats.timed("wait_for_batch"):
+                    item = batch_queue.get()
+                if item is None:
+                    break
+                start, rows, pixel_values = item
+                n_batch = min(batch_size, len(image_paths) - start)
+                if rows:
+                    with pipeline_stats.timed("forward", items=len(rows)):
+                        batch_embs = embed_fn(model, pixel_values, device)
+                    embs[start + np.asarray(rows)] = batch_embs
+                n_done += len(rows)
+                n_failed += n_batch - len(rows)
+                pbar.update(n_batch)
+    finally:
+        # Unblock the producer if we stop early (e.g. KeyboardInterrupt)
+        stop_event.set()
+        while producer.is_alive():
+            try:
+                batch_queue.get_nowait()
+            except queue.Empty:
+                producer.join(timeout=0.1)
+        if loader is not None:
+            loader.flush()
+
+    elapsed = time.perf_counter() - t0
+    rate = n_done / elapsed if elapsed > 0 else 0.0
+    print(f"Embedded {n_done} images in {elapsed:.1f}s ({rate:.1f} images/sec)"
+          + (f", {n_failed} failed" if n_failed else ""))
+    return embs
+
+
+def _compute_with_cache(image_paths, processor, model, device, cache, **kwargs):
+    dim = kwargs.get("dim") or model.config.hidden_size
+    embs = np.zeros((len(image_paths), dim), dtype="float32")
+    keys = [cache.file_hash(p) for p in image_paths]
+
+    hit_rows = [i for i, key in enumerate(keys) if key is not None and key in cache]
+    if hit_rows:
+        embs[hit_rows] = cache.get_many([keys[i] for i in hit_rows])
+
+    # Embed each unseen content hash once, even if several paths share it
+    todo = {}
+    for i, key in enumerate(keys):
+        if key is not None and key not in cache and key not in todo:
+            todo[key] = i
+    print(f"Embedding cache: {len(hit_rows)}/{len(image_paths)} hits, {len(todo)} new images")
+    pipeline_stats.count("embedding_cache_hits", len(hit_rows))
+    pipeline_stats.count("embedding_cache_misses", len(todo))
+
+    if todo:
+        todo_keys = list(todo)
+        new_embs = compute_image_embeddings([image_paths[todo[k]] for k in todo_keys],
+                                            processor, model, device, **kwargs)
+        # Don't cache failures (zero rows), so they are retried next run
+        ok = np.linalg.norm(new_embs, axis=1) > 0
+        cache.put_many([k for k, good in zip(todo_keys, ok) if good], new_embs[ok])
+        new_by_key = dict(zip(todo_keys, new_embs))
+        for i, key in enumerate(keys):
+            if key in new_by_key:
+                embs[i] = new_by_key[key]
+
+    cache.save()
+    return embs
@@ -0,0 +1,143 @@
+# embedding_store.py
+# Memory-mappable embedding matrices with a compact path table.
+#
+# A store with prefix P consists of:
+#   P.json          header: model_name, dim, count, available variants
+#   P.paths.txt     one image path per row (utf-8, newline separated)
+#   P.ids.npy       int64 FAISS id per row
+#   P.float32.npy   the embeddings
+#   P.float16.npy   optional: half precision (half the size)
+#   P.int8.npy      optional: per-dimension scalar quantisation (a quarter of the size)
+#   P.int8_params.npz   scale and offset per dimension for the int8 variant
+#
+# The .npy files are opened with mmap_mode="r", so several processes share one copy
+# through the page cache and nothing is loaded before it is used. iter_chunks()
+# dequantises block by block, so an index can be built without a second full copy.
+import json
+import os
+
+import numpy as np
+
+VARIANTS = ("float32", "float16", "int8")
+CHUNK_ROWS = 16384
+
+
+def _write_npy(path, array_chunks, shape, dtype):
+    out = np.lib.format.open_memmap(path + ".tmp", mode="w+", dtype=dtype, shape=shape)
+    row = 0
+    for chunk in array_chunks:
+        out[row:row + len(chunk)] = chunk
+        row += len(chunk)
+    out.flush()
+    del out
+    os.replace(path + ".tmp", path)
+
+
+def _chunks(embs, chunk_rows=CHUNK_ROWS):
+    for start in range(0, len(embs), chunk_rows):
+        yield np.asarray(embs[start:start + chunk_rows], dtype="float32")
+
+
+def int8_params(embs, chunk_rows=CHUNK_ROWS):
+    """
+    Per-dimension (scale, offset) mapping [min, max] onto [-127, 127].
+    """
+    lo = np.full(embs.shape[1], np.inf, dtype="float32")
+    hi = np.full(embs.shape[1], -np.inf, dtype="float32")
+    for chunk in _chunks(embs, chunk_rows):
+        lo = np.minimum(lo, chunk.min(axis=0))
+        hi = np.maximum(hi, chunk.max(axis=0))
+    scale = np.maximum(hi - lo, 1e-12) / 254.0
+    offset = (hi + lo) / 2.0
+    return scale.astype("float32"), offset.astype("float32")
+
+
+def write_store(prefix, paths, ids, embs, model_name="", variants=VARIANTS):
+    """
+    Writes embs (any array-like, e.g. a memmap) with its paths and ids as a store.
+    """
+    embs = np.asarray(embs)
+    n, dim = embs.shape
+    os.makedirs(os.path.dirname(prefix) or ".", exist_ok=True)
+
+    with open(prefix + ".paths.txt", "w", encoding="utf-8") as f:
+        f.write("\n".join(paths))
+    np.save(prefix + ".ids.npy", np.asarray(ids, dtype="int64"))
+
+    if "float32" in variants:
+        _write_npy(prefix + ".float32.npy", _chunks(embs), (n, dim), "float32")
+    if "float16" in variants:
+        _write_npy(prefix + ".float16.npy", (c.astype("float16") for c in _chunks(embs)), (n, dim), "float16")
+    if "int8" in variants:
+        scale, offset = int8_params(embs)
+        np.savez(prefix + ".int8_params.npz", scale=scale, offset=offset)
+        quantised = (np.clip(np.rint((c - offset) / scale), -127, 127).astype("int8") for c in _chunks(embs))
+        _write_npy(prefix + ".int8.npy", quantised, (n, dim), "int8")
+
+    header = {"version": 1, "model_name": model_name, "dim": int(dim), "count": int(n),
+              "variants": [v for v in VARIANTS if v in variants]}
+    with open(prefix + ".json", "w", encoding="utf-8") as f:
+        json.dump(header, f, indent=2)
+
+
+def store_exists(prefix):
+    return os.path.exists(prefix + ".json")
+
+
+class EmbeddingStore:
+    """
+    Read-only, memory-mapped view of one variant of a store.
+    """
+
+    def __init__(self, prefix, variant="float32"):
+        with open(prefix + ".json", "r", encoding="utf-8") as f:
+            self.header = json.load(f)
+        if variant not in self.header["variants"]:
+            raise ValueError(f"Variant '{variant}' not in store {prefix} ({self.header['variants']})")
+        self.prefix = prefix
+        self.variant = variant
+        self.data = np.load(f"{prefix}.{variant}.npy", mmap_mode="r")
+        self.ids = np.load(prefix + ".ids.npy", mmap_mode="r")
+        self.scale = self.offset = None
+        if variant == "int8":
+            params = np.load(prefix + ".int8_params.npz")
+            self.scale, self.offset = params["scale"], params["offset"]
+        self._paths = None
+
+    @property
+    def paths(self):
+        if self._paths is None:
+            with open(self.prefix + ".paths.txt", "r", encoding="utf-8") as f:
+                self._paths = f.read().split("\n") if self.header["count"] else []
+        return self._paths
+
+    @property
+    def dim(self):
+        return self.header["dim"]
+
+    def __len__(self):
+        return self.header["count"]
+
+    def nbytes(self):
+        return int(self.data.nbytes)
+
+    def _dequantise(self, block):
+        if self.variant == "int8":
+            block = block.astype("float32") * self.scale + self.offset
+            # Re-normalise: inner product search expects unit vectors
+            norms = np.linalg.norm(block, axis=1, keepdims=True)
+            return block / np.maximum(norms, 1e-12)
+        return np.asarray(block, dtype="float32")
+
+    def rows(self, index):
+        """
+        float32 rows for an index array / slice.
+        """
+        return self._dequantise(self.data[index])
+
+    def iter_chunks(self, chunk_rows=CHUNK_ROWS):
+        """
+        Yields (start, float32 block) over the whole store.
+        """
+        for start in range(0, len(self), chunk_rows):
+            yield start, self._dequantise(self.data[start:start + chunk_rows])
@@ -0,0 +1,202 @@
+# evaluate.py
+# Runs the matcher on the ground-truth set and reports retrieval quality + run cost.
+#
+# Ground truth: NK_collectie/images_to_match_GT.csv lists the NK photos of objects that
+# are known to be in the DHM set. The DHM inventory number(s) of each object come from
+# a "dhm_number" column in that CSV or, if it has none, from a separate CSV with columns
+# object_number,dhm_number (one row per known match, see --gt-matches).
+#
+# Evaluation is at object-number level: the ranked DHM results of all photos of an
+# object are merged (best similarity per DHM base) and the rank of the first correct
+# base gives recall@1/10/100 and MRR.
+#
+# The matcher is configured as for nk_matcher.py (--config / --set), so the backend,
+# image loader, index type, search mode, re-ranking and grouping are all measured.
+#
+# Example:
+#   python evaluate.py --config configs/dinov2_base.json --set search_mode=object
+#   python evaluate.py --store-variants float32 float16 int8   # also score the compact stores
+import argparse
+import os
+import sys
+from collections import defaultdict
+
+import numpy as np
+
+import embedding_store
+import index_sync
+import index_types
+import nk_matcher
+import pipeline_stats
+
+GT_CSV = "NK_collectie/images_to_match_GT.csv"
+GT_MATCHES_CSV = "NK_collectie/images_to_match_GT_dhm.csv"
+GT_DHM_COLUMN = "dhm_number"
+K_VALUES = (1, 10, 100)
+
+
+def load_ground_truth(gt_csv, gt_matches_csv):
+    """
+    Returns (photos, truth): photos is a list of (object_number, path) for the photos
+    that exist on disk, truth maps object_number -> set of DHM bases.
+    """
+    import pandas as pd
+
+    df = pd.read_csv(gt_csv, dtype=str)
+    if GT_DHM_COLUMN in df.columns:
+        pairs = df[["object_number", GT_DHM_COLUMN]]
+    elif gt_matches_csv and os.path.exists(gt_matches_csv):
+        pairs = pd.read_csv(gt_matches_csv, dtype=str)[["object_number", GT_DHM_COLUMN]]
+    else:
+        raise ValueError(
+            f"No ground-truth DHM numbers: '{gt_csv}' has no '{GT_DHM_COLUMN}' column "
+            f"and '{gt_matches_csv}' does not exist")
+
+    truth = defaultdict(set)
+    for obj, dhm in pairs.dropna().itertuples(index=False):
+        for number in str(dhm).split(";"):
+            if number.strip():
+                truth[obj].add(number.strip())
+
+    photos = [(obj, p) for obj, p in df[["object_number", "reproduction.path"]].itertuples(index=False)
+              if obj in truth and os.path.exists(str(p))]
+    return photos, dict(truth)
+
+
+def merge_object_rankings(photo_rows, D, I, base_of_id):
+    """
+    Merges the search results of one object's photos into one ranking of DHM bases,
+    scored by the best similarity any photo reached for any image of that base.
+    """
+    best = {}
+    for row in photo_rows:
+        for sim, idx in zip(D[row], I[row]):
+            if idx < 0:
+                continue
+            base = base_of_id[idx]
+            if sim > best.get(base, -np.inf):
+                best[base] = float(sim)
+    return sorted(best, key=best.get, reverse=True)
+
+
+def first_hit_ranks(photos, truth, D, I, base_of_id):
+    """
+    {object_number: 1-based rank of the first correct DHM base, or None}.
+    """
+    rows_by_object = defaultdict(list)
+    for row, (obj, _) in enumerate(photos):
+        rows_by_object[obj].append(row)
+    per_object = {}
+    for obj, rows in sorted(rows_by_object.items()):
+        ranking = merge_object_rankings(rows, D, I, base_of_id)
+        per_object[obj] = next((r + 1 for r, b in enumerate(ranking) if b in truth[obj]), None)
+    return per_object
+
+
+def retrieval_metrics(first_hit_ranks, k_values=K_VALUES):
+    """
+    first_hit_ranks: 1-based rank of the first correct base per object, None if not found.
+    """
+    n = len(first_hit_ranks)
+    metrics = {f"recall@{k}": round(sum(1 for r in first_hit_ranks if r and r <= k) / n, 4)
+               for k in k_values}
+    metrics["mrr"] = round(sum(1.0 / r for r in first_hit_ranks if r) / n, 4)
+    metrics["n_objects"] = n
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the DINO matcher on the ground-truth set")
+    parser.add_argument("--config", action="append", default=[], metavar="JSON",
+                        help="nk_matcher settings (model, dir2, backend, image loader, index, search mode, ...)")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", dest="overrides",
+                        help="override one nk_matcher setting, e.g. --set index_type=hnsw")
+    parser.add_argument("--gt", default=GT_CSV)
+    parser.add_argument("--gt-matches", default=GT_MATCHES_CSV)
+    parser.add_argument("--search-k", type=int, default=1000,
+                        help="results per query (over-fetched so >=100 distinct bases remain)")
+    parser.add_argument("--report", default=None, help="JSON report path")
+    parser.add_argument("--store-variants", nargs="*", default=[], choices=embedding_store.VARIANTS,
+                        help="Also score an exact index built from these embedding store variants")
+    args = parser.parse_args()
+
+    try:
+        config = nk_matcher.load_config(args.config, args.overrides)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    matcher = nk_matcher.Matcher(config)
+    stats = matcher.stats
+    pipeline_stats.activate(stats)
+    report_file = args.report or f"eval_{matcher.index_config}_{config['index_type']}.json"
+
+    try:
+        with stats.stage("load_ground_truth"):
+            photos, truth = load_ground_truth(args.gt, args.gt_matches)
+    except ValueError as e:
+        print(f"Error: {e}\nExpected a '{GT_DHM_COLUMN}' column in {args.gt} or a CSV (--gt-matches) with "
+              f"columns object_number,{GT_DHM_COLUMN}: one row per known match, several DHM numbers "
+              f"separated by ';'")
+        sys.exit(1)
+    print(f"Ground truth: {len(photos)} photos of {len({o for o, _ in photos})} objects")
+
+    # Index, embeddings and search exactly as nk_matcher.py runs them with this config
+    try:
+        matcher.index_stage()
+        index, manifest = matcher.index, matcher.index_manifest
+        base_of_id = {idx: index_sync.dhm_base(p) for idx, p in index_sync.idx_to_path_of(manifest).items()}
+
+        paths = [p for _, p in photos]
+        with stats.stage("embed_queries", items=len(photos)):
+            queries = matcher.compute_image_embeddings(paths).astype("float32")
+
+        source_rows, D, I = matcher.search(queries, paths, [o for o, _ in photos], args.search_k)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    with stats.stage("score"):
+        # One result row per photo, or per object in search_mode "object"
+        result_objects = [(photos[rows[0]][0], None) for rows in source_rows]
+        per_object = first_hit_ranks(result_objects, truth, D, I, base_of_id)
+        metrics = retrieval_metrics(list(per_object.values()))
+
+    print("\n" + "  ".join(f"{name}={value}" for name, value in metrics.items()))
+
+    # Accuracy / size of the compact store variants, each searched per photo with an exact index
+    variant_results = {}
+    if args.store_variants:
+        k = min(args.search_k, index.ntotal)
+        # A scratch store: the matcher's own <index_config>.emb keeps its configured variants
+        store_prefix = "eval_" + matcher.index_config + ".emb"
+        store_files = manifest["files"]
+        store_paths = list(store_files)
+        with stats.stage("write_store", items=len(store_paths)):
+            embedding_store.write_store(
+                store_prefix, store_paths, [store_files[p]["id"] for p in store_paths],
+                matcher.compute_image_embeddings(store_paths), model_name=config["model_name"],
+                variants=args.store_variants)
+        for variant in args.store_variants:
+            store = embedding_store.EmbeddingStore(store_prefix, variant)
+            with stats.stage(f"search_{variant}", items=len(queries)):
+                variant_index = index_types.build_index_from_store("flat", store)
+                Dv, Iv = variant_index.search(np.ascontiguousarray(queries, dtype="float32"), k)
+            variant_results[variant] = {
+                "bytes": store.nbytes(),
+                **retrieval_metrics(list(first_hit_ranks(photos, truth, Dv, Iv, base_of_id).values())),
+            }
+            print(f"  {variant}: {variant_results[variant]}")
+
+    stats.print_summary()
+    stats.save(
+        report_file,
+        config=dict(config, search_k=args.search_k, device=matcher.model()[2], gt=args.gt,
+                    n_index_vectors=int(index.ntotal)),
+        metrics=metrics,
+        first_hit_rank=per_object,
+        store_variants=variant_results,
+    )
+    print(f"✓ Report written to {report_file}")
+
+
+if __name__ == "__main__":
+    main()
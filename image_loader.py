@@ -0,0 +1,159 @@
+# image_loader.py
+# Image decoding for the embedder, with two optional shortcuts:
+#
+#   mode "draft"   JPEGs are decoded at a reduced scale (1/2, 1/4 or 1/8, done by the
+#                  JPEG decoder itself) that is still at least the processor's resize
+#                  target, instead of at the full resolution of the scan. Other formats
+#                  (PNG, TIFF, ...) are decoded as before.
+#   pixel cache    the processor output of every image is kept (float16) under the
+#                  file's content hash and the preprocessing settings, but not the model,
+#                  so another model with the same preprocessing skips decoding and
+#                  preprocessing altogether. float16 pixels change embeddings by ~1e-3;
+#                  worth it for trying several models on the same images.
+#
+# Draft decoding gives slightly different pixels than full decoding + resizing, so the
+# mode is part of the embedding cache key and the index header (see loader_settings);
+# "full" adds nothing to them, so existing caches stay valid.
+import json
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+import pipeline_stats
+from embedding_cache import CACHE_DIR, EmbeddingCache
+
+LOADERS = ("full", "draft")
+PIXEL_CACHE_FLUSH = 512  # images per pixel-cache shard
+
+
+def loader_settings(mode):
+    """
+    Extra settings for EmbeddingCache / the index header (None for "full").
+    """
+    if mode not in LOADERS:
+        raise ValueError(f"Unknown image loader '{mode}', choose from {LOADERS}")
+    return None if mode == "full" else {"loader": mode}
+
+
+def merge_settings(*settings):
+    """
+    One extra-settings dict from several (None if all are None).
+    """
+    merged = {}
+    for s in settings:
+        merged.update(s or {})
+    return merged or None
+
+
+def decode_size(processor):
+    """
+    Smallest side the processor resizes to (the draft decode must not go below it).
+    """
+    size = getattr(processor, "size", None) or {}
+    if isinstance(size, dict):
+        side = size.get("shortest_edge") or min(size.get("height", 0), size.get("width", 0))
+    else:
+        side = int(size)
+    crop = getattr(processor, "crop_size", None) or {}
+    if isinstance(crop, dict):
+        side = max(side or 0, crop.get("height", 0), crop.get("width", 0))
+    return side or 224
+
+
+def open_image(source, mode="full", size=224):
+    """
+    Decoded RGB image from a path or PIL image; with mode "draft" JPEGs are decoded
+    at the smallest scale whose sides are both >= size.
+    """
+    img = source if isinstance(source, Image.Image) else Image.open(source)
+    if mode == "draft" and img.format == "JPEG":
+        img.draft("RGB", (size, size))
+    return img.convert("RGB")
+
+
+class PixelCache(EmbeddingCache):
+    """
+    Processor outputs (flattened, float16) by content hash, shared between models that
+    have the same preprocessing. Thread-safe; new rows are written in shards of
+    PIXEL_CACHE_FLUSH images.
+    """
+
+    def __init__(self, processor, mode="full", cache_dir=CACHE_DIR, hashes=None):
+        super().__init__("pixels", processor, cache_dir=cache_dir, extra=loader_settings(mode), dtype="float16",
+                         hashes=hashes)
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.shape_file = os.path.join(self.dir, "shape.json")
+        self.shape = None
+        if os.path.exists(self.shape_file):
+            with open(self.shape_file, "r", encoding="utf-8") as f:
+                self.shape = tuple(json.load(f))
+
+    def get(self, path):
+        """
+        (content hash, CHW float32 array or None). The hash is None if the file can't be read.
+        """
+        key = self.file_hash(path)
+        with self.lock:
+            if key is None or self.shape is None or key not in self:
+                return key, None
+            return key, self.get_many([key])[0].reshape(self.shape)
+
+    def add(self, key, pixel_values):
+        with self.lock:
+            if self.shape is None:
+                self.shape = tuple(pixel_values.shape)
+                with open(self.shape_file, "w", encoding="utf-8") as f:
+                    json.dump(self.shape, f)
+            self.pending[key] = pixel_values.ravel()
+            if len(self.pending) >= PIXEL_CACHE_FLUSH:
+                self._flush()
+
+    def _flush(self):
+        if self.pending:
+            keys = list(self.pending)
+            self.put_many(keys, np.stack([self.pending[k] for k in keys]))
+            self.pending = {}
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+            self.save()
+
+
+class ImageLoader:
+    """
+    Decode + preprocess for embedding_engine, with the loader mode and optional pixel cache.
+    hashes: the embedding cache's FileHashIndex, so each file is hashed only once.
+    """
+
+    def __init__(self, processor, mode="full", pixel_cache_dir=None, hashes=None):
+        loader_settings(mode)  # validates mode
+        self.processor = processor
+        self.mode = mode
+        self.size = decode_size(processor)
+        self.pixel_cache = PixelCache(processor, mode, pixel_cache_dir, hashes) if pixel_cache_dir else None
+
+    def prepare(self, source):
+        """
+        CHW float32 array for a file path or PIL image. Raises on unreadable images.
+        """
+        key = None
+        if self.pixel_cache is not None and isinstance(source, str):
+            key, pixel_values = self.pixel_cache.get(source)
+            if pixel_values is not None:
+                pipeline_stats.count("pixel_cache_hits")
+                return pixel_values
+        with pipeline_stats.timed("decode", items=1):
+            img = open_image(source, self.mode, self.size)
+        with pipeline_stats.timed("preprocess", items=1):
+            pixel_values = self.processor(images=img, return_tensors="np")["pixel_values"][0]
+        if key is not None:
+            self.pixel_cache.add(key, pixel_values)
+        return pixel_values
+
+    def flush(self):
+        if self.pixel_cache is not None:
+            self.pixel_cache.flush()
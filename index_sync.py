@@ -0,0 +1,306 @@
+# index_sync.py
+# Keeps the cached FAISS index of the DHM image folder in line with the folder itself.
+#
+# The index is an IndexIDMap2, so every vector carries a stable id. The mapping file
+# next to it holds the manifest: which file each id belongs to plus the size, mtime
+# and content hash the file had when it was embedded. On every run the folder is
+# compared with that manifest:
+#   - new files are embedded and added
+#   - deleted files are removed from the index
+#   - files whose content changed are removed and re-added under a new id
+#
+# The manifest is saved as <name>.manifest.npz (plain arrays, loaded with
+# allow_pickle=False): a header (model_name, dim, index_type, preprocessing
+# signature, folder) plus one row per file with path, DHM base, id, size, mtime and
+# sha1; paths and bases are stored as one utf-8 blob + offsets. An index whose
+# header doesn't match the current config is not used but rebuilt.
+import io
+import json
+import os
+import pickle
+
+import faiss
+import numpy as np
+
+import index_types
+from embedding_cache import sha1_of_file
+
+MANIFEST_VERSION = 2
+HEADER_KEYS = ("model_name", "dim", "index_type", "preprocessing", "folder")
+IMAGE_EXTENSIONS = (".jpg",)
+
+
+def list_image_files(folder):
+    return sorted(
+        os.path.join(folder, f) for f in os.listdir(folder)
+        if f.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def dhm_base(path):
+    """
+    DHM inventory number of an image: file name up to the first "_" (crops are <base>_0.jpg, ...).
+    """
+    return os.path.splitext(os.path.basename(path))[0].split("_")[0]
+
+
+def _stat(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def new_manifest(index_type="flat", header=None):
+    manifest = {key: None for key in HEADER_KEYS}
+    manifest.update(header or {})
+    manifest.update({"version": MANIFEST_VERSION, "index_type": index_type, "next_id": 0, "files": {}})
+    return manifest
+
+
+def header_mismatch(manifest, header):
+    """
+    Names of the header fields in which manifest differs from header (unknown values are ignored).
+    """
+    return [key for key, value in header.items()
+            if value is not None and manifest.get(key) is not None and manifest[key] != value]
+
+
+def idx_to_path_of(manifest):
+    """
+    FAISS id -> image path, for turning search results into paths.
+    """
+    return {entry["id"]: path for path, entry in manifest["files"].items()}
+
+
+def _as_id_map(index):
+    """
+    Wraps a plain (legacy) index in an IndexIDMap2, keeping ids 0..ntotal-1.
+    """
+    if isinstance(index, faiss.IndexIDMap2):
+        return index
+    vectors = index.reconstruct_n(0, index.ntotal)
+    id_map = faiss.IndexIDMap2(faiss.IndexFlatIP(index.d))
+    id_map.add_with_ids(vectors, np.arange(index.ntotal, dtype="int64"))
+    return id_map
+
+
+def _pack_strings(strings):
+    """
+    Strings -> (utf-8 blob, offsets) arrays; string i is blob[offsets[i]:offsets[i + 1]].
+    """
+    encoded = [x.encode("utf-8") for x in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype="int64")
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype="uint8"), offsets
+
+
+def _unpack_strings(blob, offsets):
+    data = blob.tobytes()
+    return [data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+
+def write_manifest(manifest, manifest_file):
+    paths = list(manifest["files"])
+    entries = [manifest["files"][p] for p in paths]
+    path_blob, path_offsets = _pack_strings(paths)
+    # Many crops share one DHM base: store each base once
+    bases = [dhm_base(p) for p in paths]
+    base_names = sorted(set(bases))
+    base_codes = {b: i for i, b in enumerate(base_names)}
+    base_blob, base_offsets = _pack_strings(base_names)
+    header = {key: manifest.get(key) for key in HEADER_KEYS}
+    header.update(version=MANIFEST_VERSION, next_id=manifest["next_id"], count=len(paths))
+
+    buf = io.BytesIO()
+    np.savez(
+        buf,
+        header=np.frombuffer(json.dumps(header).encode("utf-8"), dtype="uint8"),
+        path_blob=path_blob, path_offsets=path_offsets,
+        base_blob=base_blob, base_offsets=base_offsets,
+        base=np.array([base_codes[b] for b in bases], dtype="int32"),
+        id=np.array([e["id"] for e in entries], dtype="int64"),
+        # -1 / "" for stats that are unknown (converted legacy entries whose file is gone)
+        size=np.array([-1 if e["size"] is None else e["size"] for e in entries], dtype="int64"),
+        mtime_ns=np.array([-1 if e["mtime_ns"] is None else e["mtime_ns"] for e in entries], dtype="int64"),
+        sha1=np.array([e["sha1"] or "" for e in entries], dtype="S40"),
+    )
+    tmp = manifest_file + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(buf.getvalue())
+    os.replace(tmp, manifest_file)
+
+
+def read_manifest(manifest_file):
+    with np.load(manifest_file, allow_pickle=False) as z:
+        header = json.loads(z["header"].tobytes().decode("utf-8"))
+        if header.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"{manifest_file}: unsupported manifest version {header.get('version')}")
+        paths = _unpack_strings(z["path_blob"], z["path_offsets"])
+        ids, sizes, mtimes, sha1s = (z[name].tolist() for name in ("id", "size", "mtime_ns", "sha1"))
+    manifest = new_manifest(header["index_type"], {key: header.get(key) for key in HEADER_KEYS})
+    manifest["next_id"] = header["next_id"]
+    manifest["files"] = {
+        path: {"id": idx,
+               "size": None if size < 0 else size,
+               "mtime_ns": None if mtime < 0 else mtime,
+               "sha1": sha1.decode("ascii") or None}
+        for path, idx, size, mtime, sha1 in zip(paths, ids, sizes, mtimes, sha1s)
+    }
+    return manifest
+
+
+class _PlainDataUnpickler(pickle.Unpickler):
+    """
+    Unpickler for the old .pkl mappings: dicts, ints and strings only, no classes.
+    """
+
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(f"Refusing to load {module}.{name} from an index mapping")
+
+
+def _load_legacy_mapping(pkl_file, file_hash):
+    """
+    Old caches: a pickled {id: path} dict, or the pickled manifest dict of MANIFEST_VERSION 1.
+    Returns (manifest, converted_from_id_map).
+    """
+    with open(pkl_file, "rb") as f:
+        legacy = _PlainDataUnpickler(f).load()
+    if "files" in legacy:
+        manifest = new_manifest(legacy.get("index_type", "flat"))
+        manifest["next_id"] = legacy["next_id"]
+        manifest["files"] = legacy["files"]
+        return manifest, False
+
+    manifest = new_manifest()
+    for idx, path in legacy.items():
+        # Stats are unknown; record them now so later changes are detected
+        entry = {"id": int(idx), "size": None, "mtime_ns": None, "sha1": None}
+        if os.path.exists(path):
+            entry["size"], entry["mtime_ns"] = _stat(path)
+            entry["sha1"] = file_hash(path)
+        manifest["files"][path] = entry
+    manifest["next_id"] = max(legacy.keys(), default=-1) + 1
+    return manifest, True
+
+
+def load_index(faiss_index_file, manifest_file, file_hash=sha1_of_file, header=None):
+    """
+    Loads index + manifest. Returns (None, None) if they don't exist yet, or if the
+    manifest was made for another config than header (model_name, dim, ...): the
+    caller then builds a fresh index, which replaces the old files on save.
+    Old caches (<name>.pkl next to the .faiss file) are converted on the fly.
+    """
+    if not os.path.exists(faiss_index_file):
+        return None, None
+    legacy_file = os.path.splitext(faiss_index_file)[0] + ".pkl"
+    from_id_map = False
+    if os.path.exists(manifest_file):
+        manifest = read_manifest(manifest_file)
+    elif os.path.exists(legacy_file):
+        print(f"Converting old index mapping {legacy_file} to {manifest_file}...")
+        manifest, from_id_map = _load_legacy_mapping(legacy_file, file_hash)
+        manifest["converted"] = True  # makes the next sync write the new format
+    else:
+        return None, None
+
+    header = header or {}
+    mismatch = header_mismatch(manifest, header)
+    if mismatch:
+        print(f"Index {faiss_index_file} was built with other settings "
+              f"({', '.join(f'{k}: {manifest[k]!r} != {header[k]!r}' for k in mismatch)}); rebuilding.")
+        return None, None
+
+    index = faiss.read_index(faiss_index_file)
+    if from_id_map:
+        index = _as_id_map(index)
+    if index.ntotal != len(manifest["files"]) or (header.get("dim") and index.d != header["dim"]):
+        print(f"Index {faiss_index_file} does not match its manifest; rebuilding.")
+        return None, None
+    # Old caches have no header yet: record the current settings
+    for key, value in header.items():
+        if manifest.get(key) is None:
+            manifest[key] = value
+    return index, manifest
+
+
+def save_index(index, manifest, faiss_index_file, manifest_file):
+    if manifest.get("dim") is None:
+        manifest["dim"] = int(index.d)
+    faiss.write_index(index, faiss_index_file)
+    write_manifest(manifest, manifest_file)
+
+
+def sync_index(index, manifest, folder, embed_fn, file_hash=sha1_of_file, index_type="flat",
+               header=None, **index_params):
+    """
+    Brings index + manifest in line with the images currently in folder.
+
+    embed_fn(paths) must return one embedding row per path (zero row on failure).
+    file_hash(path) returns the content hash; pass EmbeddingCache.file_hash to reuse
+    its memoised hashes. If index is None a new index_type index is built from the
+    embeddings (index_params go to index_types.build_index) and header is recorded in
+    its manifest. Indexes that can't remove
+    vectors (hnsw) are rebuilt from the cache when files disappear or change.
+    Returns (index, manifest, changed).
+    """
+    if manifest is None:
+        manifest = new_manifest(index_type, header)
+    files = manifest["files"]
+    current = list_image_files(folder)
+    current_set = set(current)
+
+    removed = [p for p in files if p not in current_set]
+    new = [p for p in current if p not in files]
+
+    # A file counts as changed only if its stats differ AND its content hash differs
+    changed = []
+    for path in current:
+        entry = files.get(path)
+        if entry is None:
+            continue
+        size, mtime_ns = _stat(path)
+        if (size, mtime_ns) == (entry["size"], entry["mtime_ns"]):
+            continue
+        digest = file_hash(path)
+        if digest is not None and digest == entry["sha1"]:
+            entry["size"], entry["mtime_ns"] = size, mtime_ns
+            continue
+        changed.append(path)
+
+    print(f"Index sync: {len(new)} new, {len(changed)} changed, {len(removed)} removed "
+          f"({len(files)} indexed, {len(current)} in folder)")
+
+    dirty = bool(removed or changed or new or manifest.pop("converted", False))
+
+    drop = [files[p]["id"] for p in removed + changed]
+    for p in removed + changed:
+        del files[p]
+
+    rebuild = index is None or (drop and not index_types.supports_remove(index_type))
+    if drop and not rebuild:
+        index.remove_ids(np.array(drop, dtype="int64"))
+
+    to_embed = changed + new
+    if rebuild and index is not None:
+        # Re-embed what stays in the index too (cheap with the embedding cache)
+        print(f"Rebuilding {index_type} index...")
+        to_embed = list(files) + to_embed
+        files.clear()
+    if not to_embed:
+        return index, manifest, dirty
+
+    embs = np.ascontiguousarray(embed_fn(to_embed), dtype="float32")
+    ok = np.linalg.norm(embs, axis=1) > 0
+    ids = np.arange(manifest["next_id"], manifest["next_id"] + len(to_embed), dtype="int64")
+    manifest["next_id"] += len(to_embed)
+    if rebuild:
+        index = index_types.build_index(index_type, embs[ok], ids[ok], **index_params)
+    elif ok.any():
+        index.add_with_ids(embs[ok], ids[ok])
+    for path, idx, good in zip(to_embed, ids, ok):
+        # Failed images stay out of the manifest, so they are retried next sync
+        if not good:
+            continue
+        size, mtime_ns = _stat(path)
+        files[path] = {"id": int(idx), "size": size, "mtime_ns": mtime_ns, "sha1": file_hash(path)}
+
+    return index, manifest, dirty
@@ -0,0 +1,120 @@
+# index_types.py
+# FAISS index variants for the DHM image set.
+#
+#   flat      exact inner-product search (IndexFlatIP), the reference
+#   ivf_flat  inverted lists over full vectors: scans only nprobe of nlist clusters
+#   ivf_pq    inverted lists over product-quantised vectors: much smaller in memory
+#   hnsw      graph index: fast queries, but no removal (sync rebuilds it instead)
+#
+# Every variant stores the ids from the index manifest, so search results can be
+# mapped back to paths the same way.
+import math
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# Defaults, can be overridden per call
+IVF_NLIST = 1024       # no of clusters (capped for small sets, see _nlist_for)
+IVF_NPROBE = 16        # clusters scanned per query
+PQ_M = 64              # sub-quantisers (must divide the embedding dim)
+PQ_NBITS = 8
+HNSW_M = 32            # graph degree
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 128
+TRAIN_SAMPLE = 100000  # max vectors used for IVF training when building from a store
+
+
+def index_file_names(config_name, index_type):
+    """
+    (faiss file, manifest file). The flat index keeps the original base name.
+    """
+    base = config_name if index_type == "flat" else f"{config_name}_{index_type}"
+    return base + ".faiss", base + ".manifest.npz"
+
+
+def _nlist_for(n, nlist):
+    # FAISS wants ~39 training points per cluster; keep small sets trainable
+    return max(1, min(nlist, int(4 * math.sqrt(n)), n // 39 or 1))
+
+
+def supports_remove(index_type):
+    return index_type != "hnsw"
+
+
+def new_index(index_type, dim, train_vectors, n_total=None, nlist=IVF_NLIST, pq_m=PQ_M,
+              pq_nbits=PQ_NBITS, hnsw_m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION):
+    """
+    Creates an empty index of the given type, trained on train_vectors if it needs training.
+    n_total (default: len(train_vectors)) is the expected no of vectors, used to size nlist.
+    """
+    n = len(train_vectors) if n_total is None else n_total
+    if index_type == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+    if index_type in ("ivf_flat", "ivf_pq"):
+        n_train = len(train_vectors)
+        nlist = _nlist_for(min(n, n_train), nlist)
+        quantizer = faiss.IndexFlatIP(dim)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        else:
+            if dim % pq_m:
+                raise ValueError(f"PQ_M={pq_m} does not divide embedding dim {dim}")
+            # PQ needs 2**nbits training points per sub-quantiser
+            nbits = pq_nbits if n_train >= (1 << pq_nbits) else max(1, int(math.log2(max(n_train, 2))))
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, nbits, faiss.METRIC_INNER_PRODUCT)
+        # IVF indexes take ids natively and support remove_ids by id
+        print(f"Training {index_type} index (nlist={nlist}) on {n_train} vectors...")
+        index.train(np.ascontiguousarray(train_vectors, dtype="float32"))
+        return index
+    if index_type == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        hnsw.hnsw.efConstruction = ef_construction
+        return faiss.IndexIDMap2(hnsw)
+    raise ValueError(f"Unknown index type '{index_type}', choose from {INDEX_TYPES}")
+
+
+def build_index(index_type, vectors, ids, **params):
+    """
+    Creates, trains (if needed) and fills an index of the given type.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    ids = np.asarray(ids, dtype="int64")
+    index = new_index(index_type, vectors.shape[1], vectors, **params)
+    if len(vectors):
+        index.add_with_ids(vectors, ids)
+    return index
+
+
+def build_index_from_store(index_type, store, train_sample=TRAIN_SAMPLE, **params):
+    """
+    Same as build_index, but reads the vectors block by block from an EmbeddingStore
+    (see embedding_store.py), so the full matrix is never held in memory twice.
+    IVF types are trained on a random sample of at most train_sample rows.
+    """
+    n = len(store)
+    train = np.zeros((0, store.dim), dtype="float32")
+    if index_type in ("ivf_flat", "ivf_pq") and n:
+        rows = np.sort(np.random.default_rng(0).choice(n, min(n, train_sample), replace=False))
+        train = store.rows(rows)
+    index = new_index(index_type, store.dim, train, n_total=n, **params)
+    for start, block in store.iter_chunks():
+        index.add_with_ids(np.ascontiguousarray(block), np.asarray(store.ids[start:start + len(block)]))
+    return index
+
+
+def set_search_params(index, nprobe=IVF_NPROBE, ef_search=HNSW_EF_SEARCH):
+    """
+    Sets the query-time knobs (no-op for flat).
+    """
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    inner = faiss.downcast_index(inner)
+    if isinstance(inner, faiss.IndexIVF):
+        inner.nprobe = nprobe
+    elif isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = ef_search
+
+
+def index_size_bytes(index):
+    return int(faiss.serialize_index(index).size)
@@ -0,0 +1,144 @@
+# inference_backends.py
+# Selectable inference backends for the DINO embedder (mostly for CPU runs).
+#
+#   eager    stock fp32 PyTorch (the reference)
+#   bf16     bfloat16 weights + activations; fast on CPUs with AVX512-BF16 / AMX,
+#            emulated (slow) elsewhere, see benchmark_backends.py
+#   int8     dynamic int8 quantisation of all nn.Linear layers (weights int8,
+#            activations quantised per batch)
+#   compile  torch.compile on a channels-last model
+#   onnx     ONNX Runtime on an exported graph (exported once to ONNX_DIR)
+#
+# Every backend is wrapped so it looks like the HF model to embedding_engine:
+# backend(pixel_values=tensor).last_hidden_state and backend.config.hidden_size.
+# Embeddings of different backends differ slightly, so the embedding cache and the
+# index manifest record the backend (see backend_settings).
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+
+BACKENDS = ("eager", "bf16", "int8", "compile", "onnx")
+ONNX_DIR = "onnx_models"
+ONNX_OPSET = 17
+NUM_THREADS = None  # torch / onnxruntime intra-op threads; None = library default
+
+
+def backend_settings(backend):
+    """
+    Extra settings for EmbeddingCache / the index header (None for eager, so existing
+    caches stay valid).
+    """
+    return None if backend == "eager" else {"backend": backend}
+
+
+class _CastInputs(torch.nn.Module):
+    """
+    Casts pixel_values to the model's dtype / memory format before the forward pass.
+    """
+
+    def __init__(self, model, dtype=None, channels_last=False):
+        super().__init__()
+        self.model = model
+        self.config = model.config
+        self.dtype = dtype
+        self.channels_last = channels_last
+
+    def forward(self, pixel_values):
+        if self.dtype is not None:
+            pixel_values = pixel_values.to(self.dtype)
+        if self.channels_last:
+            pixel_values = pixel_values.contiguous(memory_format=torch.channels_last)
+        return self.model(pixel_values=pixel_values)
+
+
+class OnnxBackend:
+    """
+    ONNX Runtime session with the calling convention of the HF model.
+    """
+
+    def __init__(self, onnx_file, config, num_threads=NUM_THREADS):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(onnx_file, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.config = config
+
+    def __call__(self, pixel_values):
+        (hidden,) = self.session.run(["last_hidden_state"], {self.input_name: pixel_values.cpu().numpy()})
+        return SimpleNamespace(last_hidden_state=torch.from_numpy(hidden))
+
+    def eval(self):
+        return self
+
+
+def export_onnx(model, model_name, image_size, onnx_dir=ONNX_DIR):
+    """
+    Exports model to <onnx_dir>/<model>.onnx (batch size dynamic), unless it already exists.
+    """
+    onnx_file = os.path.join(onnx_dir, model_name.split("/")[-1] + ".onnx")
+    if os.path.exists(onnx_file):
+        return onnx_file
+    os.makedirs(onnx_dir, exist_ok=True)
+    print(f"Exporting {model_name} to {onnx_file}...")
+    dummy = torch.zeros(1, 3, image_size, image_size)
+    with torch.no_grad():
+        torch.onnx.export(
+            model.cpu(), (dummy,), onnx_file + ".tmp",
+            input_names=["pixel_values"], output_names=["last_hidden_state"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "last_hidden_state": {0: "batch"}},
+            opset_version=ONNX_OPSET,
+        )
+    os.replace(onnx_file + ".tmp", onnx_file)
+    return onnx_file
+
+
+def processor_image_size(processor):
+    """
+    Side of the square model input produced by the image processor.
+    """
+    size = getattr(processor, "crop_size", None) or getattr(processor, "size", None) or {}
+    if isinstance(size, dict):
+        return size.get("height") or size.get("shortest_edge") or 224
+    return int(size)
+
+
+def wrap_model(model, backend, processor=None, model_name="", device="cpu"):
+    """
+    Returns the model prepared for backend (see BACKENDS).
+    """
+    if NUM_THREADS:
+        torch.set_num_threads(NUM_THREADS)
+    if backend == "eager":
+        return model
+    if backend == "bf16":
+        return _CastInputs(model.to(torch.bfloat16), dtype=torch.bfloat16).eval()
+    if backend == "int8":
+        if device != "cpu":
+            raise ValueError("int8 dynamic quantisation runs on CPU only")
+        quantized = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return _CastInputs(quantized).eval()
+    if backend == "compile":
+        model = model.to(memory_format=torch.channels_last)
+        return _CastInputs(torch.compile(model), channels_last=True).eval()
+    if backend == "onnx":
+        if device != "cpu":
+            raise ValueError("The onnx backend runs on CPU only")
+        onnx_file = export_onnx(model, model_name, processor_image_size(processor))
+        return OnnxBackend(onnx_file, model.config)
+    raise ValueError(f"Unknown backend '{backend}', choose from {BACKENDS}")
+
+
+def cosine_agreement(reference, embs):
+    """
+    Row-wise cosine similarity between two embedding matrices (rows failing in either are skipped).
+    """
+    ok = (np.linalg.norm(reference, axis=1) > 0) & (np.linalg.norm(embs, axis=1) > 0)
+    a = reference[ok] / np.linalg.norm(reference[ok], axis=1, keepdims=True)
+    b = embs[ok] / np.linalg.norm(embs[ok], axis=1, keepdims=True)
+    return np.sum(a * b, axis=1)
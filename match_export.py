@@ -0,0 +1,296 @@
+# match_export.py
+# Streaming export of match results.
+#
+# The search stage produces one record per source (an NK photo or object): the source
+# fields plus its (DHM id, similarity) pairs. Records are written one at a time, so
+# memory doesn't grow with sources x matches:
+#
+#   <prefix>.jsonl            one source per line, matches as [dhm path, similarity] pairs;
+#                             the hand-off to the render and export stages
+#   <prefix>.parquet          long table source (int32), rank (int16), dhm_id (int32),
+#                             similarity (float32), written in row groups; needs pyarrow
+#     <prefix>_sources.parquet    source, object_number, obj_num_base, source_path, obj_metadata
+#     <prefix>_paths.parquet      dhm_id, path, base (the path table dhm_id points into)
+#   <prefix>.csv              object_number, image1, image2, similarity (csv module, quoted)
+#   <prefix>.json             the full match_data list of earlier versions (streamed)
+#
+# URLs, filenames and bases of the matches are derived from the DHM path when the
+# records are read back (match_entry), instead of being stored for every match.
+import csv
+import json
+import os
+
+import index_sync
+
+FORMATS = ("jsonl", "parquet", "csv", "json")
+ROW_GROUP_SOURCES = 1000  # sources per Parquet row group
+
+
+def dhm_url(base):
+    return f"https://www.dhm.de/datenbank/ccp/dhm_ccp_add.php?seite=6&fld_1={base}&suchen=Suchen"
+
+
+def match_entry(img2_path, sim):
+    """
+    Match dict as used by the HTML templates.
+    """
+    base = index_sync.dhm_base(img2_path)
+    return {
+        "path": "../" + img2_path,
+        "filename": os.path.basename(img2_path),
+        "base": base,
+        "similarity": round(float(sim), 3),
+        "url": dhm_url(base),
+    }
+
+
+def source_record(i, rows, images1, object_numbers, dimensions, object_names):
+    """
+    Source fields of result row i; rows are the NK photo rows it was searched with.
+    """
+    img1_path = images1[rows[0]]
+    obj_num = object_numbers[rows[0]]
+    obj_num_base = obj_num.split("-")[0]
+    return {
+        "index": i,
+        "source_path": "../" + img1_path,
+        "source_filename": os.path.basename(img1_path),
+        "source_paths": ["../" + images1[r] for r in rows],
+        "object_number": obj_num,
+        "obj_num_base": obj_num_base,
+        "obj_metadata": f"{object_names[rows[0]]} ({dimensions[rows[0]]})",
+        "obj_NK_url": "https://wo2.collectienederland.nl/doc/nk/" + obj_num_base,
+    }
+
+
+def iter_records(source_rows, images1, object_numbers, dimensions, object_names, D, I):
+    """
+    Yields (source, [(dhm_id, similarity), ...]) per result row of (D, I).
+    """
+    for i, rows in enumerate(source_rows):
+        source = source_record(i, rows, images1, object_numbers, dimensions, object_names)
+        yield source, [(int(idx), float(sim)) for idx, sim in zip(I[i], D[i]) if idx >= 0]
+
+
+class JsonlWriter:
+    def __init__(self, prefix, idx_to_path):
+        self.file = prefix + ".jsonl"
+        self.idx_to_path = idx_to_path
+        self.f = open(self.file + ".tmp", "w", encoding="utf-8")
+
+    def write(self, source, pairs):
+        record = dict(source, matches=[[self.idx_to_path[idx], round(sim, 4)] for idx, sim in pairs])
+        self.f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self.f.close()
+        os.replace(self.file + ".tmp", self.file)
+
+    def abort(self):
+        self.f.close()
+        os.remove(self.file + ".tmp")
+
+
+class CsvWriter:
+    def __init__(self, prefix, idx_to_path):
+        self.file = prefix + ".csv"
+        self.filenames = {}
+        self.idx_to_path = idx_to_path
+        self.f = open(self.file + ".tmp", "w", encoding="utf-8", newline="")
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(["object_number", "image1", "image2", "similarity"])
+
+    def write(self, source, pairs):
+        for idx, sim in pairs:
+            if idx not in self.filenames:
+                self.filenames[idx] = os.path.basename(self.idx_to_path[idx])
+            self.writer.writerow([source["object_number"], source["source_filename"], self.filenames[idx],
+                                  round(sim, 3)])
+
+    def close(self):
+        self.f.close()
+        os.replace(self.file + ".tmp", self.file)
+
+    def abort(self):
+        self.f.close()
+        os.remove(self.file + ".tmp")
+
+
+class JsonWriter:
+    """
+    The match_data list, written item by item.
+    """
+
+    def __init__(self, prefix, idx_to_path):
+        self.file = prefix + ".json"
+        self.idx_to_path = idx_to_path
+        self.f = open(self.file + ".tmp", "w", encoding="utf-8")
+        self.f.write("[")
+        self.first = True
+
+    def write(self, source, pairs):
+        item = dict(source, matches=[match_entry(self.idx_to_path[idx], sim) for idx, sim in pairs])
+        self.f.write(("" if self.first else ", ") + json.dumps(item))
+        self.first = False
+
+    def close(self):
+        self.f.write("]")
+        self.f.close()
+        os.replace(self.file + ".tmp", self.file)
+
+    def abort(self):
+        self.f.close()
+        os.remove(self.file + ".tmp")
+
+
+class ParquetWriter:
+    """
+    Long match table with int32 indices into the source and path tables + float32 scores.
+    """
+
+    def __init__(self, prefix, idx_to_path, row_group_sources=ROW_GROUP_SOURCES):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa, self.pq = pa, pq
+        self.prefix = prefix
+        self.file = prefix + ".parquet"
+        self.idx_to_path = idx_to_path
+        self.row_group_sources = row_group_sources
+        self.schema = pa.schema([("source", pa.int32()), ("rank", pa.int16()),
+                                 ("dhm_id", pa.int32()), ("similarity", pa.float32())])
+        self.writer = pq.ParquetWriter(self.file + ".tmp", self.schema, compression="zstd")
+        self.sources = {"source": [], "object_number": [], "obj_num_base": [], "source_path": [], "obj_metadata": []}
+        self.used_ids = set()
+        self._reset()
+
+    def _reset(self):
+        self.buffer = {"source": [], "rank": [], "dhm_id": [], "similarity": []}
+        self.buffered_sources = 0
+
+    def _flush(self):
+        if self.buffered_sources:
+            self.writer.write_table(self.pa.table(self.buffer, schema=self.schema))
+        self._reset()
+
+    def write(self, source, pairs):
+        i = source["index"]
+        for key in ("object_number", "obj_num_base", "obj_metadata"):
+            self.sources[key].append(source[key])
+        self.sources["source"].append(i)
+        self.sources["source_path"].append(source["source_path"][len("../"):])
+        for rank, (idx, sim) in enumerate(pairs):
+            self.buffer["source"].append(i)
+            self.buffer["rank"].append(rank)
+            self.buffer["dhm_id"].append(idx)
+            self.buffer["similarity"].append(sim)
+            self.used_ids.add(idx)
+        self.buffered_sources += 1
+        if self.buffered_sources >= self.row_group_sources:
+            self._flush()
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+        os.replace(self.file + ".tmp", self.file)
+        pa, pq = self.pa, self.pq
+        pq.write_table(pa.table(self.sources), self.prefix + "_sources.parquet", compression="zstd")
+        ids = sorted(self.used_ids)
+        paths = [self.idx_to_path[i] for i in ids]
+        pq.write_table(pa.table({"dhm_id": pa.array(ids, pa.int32()), "path": paths,
+                                 "base": [index_sync.dhm_base(p) for p in paths]}),
+                       self.prefix + "_paths.parquet", compression="zstd")
+
+    def abort(self):
+        self.writer.close()
+        os.remove(self.file + ".tmp")
+
+
+WRITERS = {"jsonl": JsonlWriter, "parquet": ParquetWriter, "csv": CsvWriter, "json": JsonWriter}
+
+
+class MatchExporter:
+    """
+    Writes (source, pairs) records to every format in formats, as they come in.
+    """
+
+    def __init__(self, prefix, idx_to_path, formats=("jsonl",)):
+        unknown = [f for f in formats if f not in WRITERS]
+        if unknown:
+            raise ValueError(f"Unknown export format(s) {unknown}, choose from {FORMATS}")
+        self.writers = []
+        for fmt in formats:
+            try:
+                self.writers.append(WRITERS[fmt](prefix, idx_to_path))
+            except ImportError:
+                print(f"Warning: pyarrow is not installed, skipping the {fmt} export (pip install pyarrow)")
+        self.count = 0
+
+    def write(self, source, pairs):
+        for writer in self.writers:
+            writer.write(source, pairs)
+        self.count += 1
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+            print(f"Written {writer.file} ({self.count} sources)")
+
+    def abort(self):
+        """
+        Closes the writers and removes their unfinished .tmp files; the previous exports stay.
+        """
+        for writer in self.writers:
+            try:
+                writer.abort()
+            except OSError as e:
+                print(f"Warning: could not remove {writer.file}.tmp: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def read_jsonl_records(path):
+    """
+    Yields (source, pairs) from a .jsonl export; pairs are (dhm path, similarity).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield record, record.pop("matches")
+
+
+def read_match_data(path):
+    """
+    The match_data list (as the HTML templates use it) from a .jsonl or .json export.
+    """
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return [dict(source, matches=[match_entry(p, sim) for p, sim in pairs])
+            for source, pairs in read_jsonl_records(path)]
+
+
+def convert_jsonl(path, prefix, formats):
+    """
+    Streams a .jsonl export into the other formats (see MatchExporter).
+    """
+    # The writers take DHM ids: number the paths in order of appearance
+    ids, paths = {}, []
+
+    def id_of(p):
+        if p not in ids:
+            ids[p] = len(paths)
+            paths.append(p)
+        return ids[p]
+
+    with MatchExporter(prefix, paths, [f for f in formats if f != "jsonl"]) as exporter:
+        for source, pairs in read_jsonl_records(path):
+            exporter.write(source, [(id_of(p), sim) for p, sim in pairs])
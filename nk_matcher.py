@@ -0,0 +1,493 @@
+# nk_matcher.py
+# Command-line interface to the matcher, one subcommand per stage:
+#
+#   index    bring the FAISS index of the DHM set (dir2) in line with the folder   [torch, faiss]
+#   embed    embed the NK photos of csv1_path into the store <model>_<csv>.emb     [torch]
+#   search   search the index with the stored NK embeddings and save
+#            <output folder>/<html_name>_matches.jsonl  [faiss; torch only with rerank_top_n]
+#   render   HTML site from the saved matches                                     [jinja2, PIL]
+#   export   Parquet / CSV / JSON from the saved matches (export_formats)
+#   run      all of the above (this is what compare_images_DINO_v4-2.py does)
+#
+# Settings: DEFAULTS below, overridden by JSON config files (--config, later files win)
+# and by --set key=value (value parsed as JSON, else taken as a string). Example:
+#   python nk_matcher.py search --config configs/dinov2_base.json --set rerank_top_n=50
+#   python nk_matcher.py render --set site_viewer=data
+#
+# torch, transformers and faiss are only imported by the stages that need them, so
+# render and export start without loading a model. Each stage reads what the stage
+# before it wrote (index files, embedding store, matches .jsonl), so it can be rerun on
+# its own; search does not rescan dir2, run index first after the folder changed.
+# Every invocation saves <html_name>_<command>_report.json in the output folder (see
+# pipeline_stats.py).
+import argparse
+import json
+import os
+import sys
+
+import pipeline_stats
+
+DEFAULTS = {
+    # Model, NK photos to match (CSV with reproduction.path) and DHM images to match with
+    "model_name": "facebook/dinov2-large",
+    "csv1_path": "NK_collectie/images_to_match.csv",
+    "dir2": "DHM/DHM_images_split_yolo_detect",
+    "output_folder": None,  # None = <model>_<dir2>_<csv>
+    "results_per_item": 100,  # max no of matches
+
+    # Embedding throughput (see embedding_engine.py)
+    "embed_batch_size": 16,  # images per forward pass
+    "embed_workers": 4,  # decode + preprocess threads
+    "embed_prefetch": 4,  # max no of prepared batches waiting for the model
+    "embedding_cache_dir": "embedding_cache",  # per-image embeddings, keyed by content hash + model; None to disable
+    # "eager" (fp32 PyTorch), "bf16", "int8", "compile" or "onnx" (see inference_backends.py);
+    # check a backend with benchmark_backends.py before switching
+    "inference_backend": "eager",
+    # Image decoding (see image_loader.py): "full" or "draft" (JPEGs decoded at reduced scale,
+    # much faster for large scans; embeds everything once more on the first run)
+    "image_loader": "full",
+    "pixel_cache_dir": None,  # e.g. "pixel_cache": preprocessed images shared between models; None = off
+
+    # FAISS index type: "flat" (exact), "ivf_flat", "ivf_pq" or "hnsw" (see index_types.py / ann_report.py)
+    "index_type": "flat",
+    "ivf_nprobe": 16,  # ivf_*: clusters scanned per query
+    "hnsw_ef_search": 128,  # hnsw: candidate list size per query
+
+    # Search unit: "image" (one result list per NK photo) or "object" (one per object_number)
+    "search_mode": "image",
+    "object_fusion": "mean",  # object mode: "mean", "max", "score_max" or "rrf" (see object_search.py)
+    # Re-rank the first rerank_top_n results per query with patch tokens (see patch_rerank.py); 0 = off
+    "rerank_top_n": 0,
+    "rerank_patch_weight": 0.5,  # final order = (1 - w) * global cosine + w * patch score
+    # Show each DHM record (base inventory number) once, via its best-scoring crop
+    "group_by_dhm_base": False,
+    "group_overfetch": 5,  # FAISS results fetched per distinct base
+
+    # Memory-mapped DHM embedding stores next to the index (see embedding_store.py); [] to skip
+    "store_variants": ["float32", "float16", "int8"],
+
+    # HTML (see render_site.py)
+    "render_workers": None,  # None = one per CPU
+    "site_viewer": "pages",  # "pages" (one HTML page per object) or "data" (viewer.html + data files)
+
+    # Files written by export (and by run): "parquet" (needs pyarrow), "csv" and/or "json"
+    # (the full match list of earlier versions); see match_export.py
+    "export_formats": ["parquet", "csv"],
+
+    # Whole-run profile next to the run report: "cprofile", "torch" or None
+    "profile": None,
+}
+
+
+def parse_value(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def load_config(config_files=(), overrides=()):
+    """
+    DEFAULTS updated with the JSON config files and "key=value" overrides, in that order.
+    """
+    config = dict(DEFAULTS)
+    updates = []
+    for path in config_files:
+        with open(path, "r", encoding="utf-8") as f:
+            updates.append((path, json.load(f)))
+    for item in overrides:
+        key, sep, value = item.partition("=")
+        if not sep:
+            raise ValueError(f"--set expects key=value, got '{item}'")
+        updates.append(("--set", {key.strip(): parse_value(value)}))
+    for source, values in updates:
+        unknown = sorted(set(values) - set(DEFAULTS))
+        if unknown:
+            raise ValueError(f"Unknown setting(s) in {source}: {', '.join(unknown)}")
+        config.update(values)
+    return config
+
+
+class Matcher:
+    """
+    The stages of the matcher for one configuration. Models, the index and the
+    results are loaded when a stage first needs them and kept for the next stage.
+    """
+
+    def __init__(self, config, stats=None):
+        self.config = config
+        self.stats = stats or pipeline_stats.RunStats()
+        self.model_shortname = config["model_name"].split("/")[-1]
+        self.csv_shortname = os.path.splitext(os.path.basename(config["csv1_path"]))[0]
+        self.config_name = self.model_shortname + "_" + os.path.basename(os.path.normpath(config["dir2"]))
+        self.html_name = self.config_name + "_" + self.csv_shortname
+        self.output_folder = config["output_folder"] or self.html_name
+        backend = config["inference_backend"]
+        # Each backend gets its own index files / NK store, so switching back and forth doesn't rebuild
+        self.index_config = self.config_name if backend == "eager" else f"{self.config_name}_{backend}"
+        self.nk_store_prefix = (self.model_shortname + "_" + self.csv_shortname
+                                + ("" if backend == "eager" else f"_{backend}") + ".emb")
+        self.matches_prefix = os.path.join(self.output_folder, f"{self.html_name}_matches")
+        self.matches_file = self.matches_prefix + ".jsonl"
+
+        self._model = None
+        self.embedding_cache = None
+        self.loader = None
+        self._nk = None
+        self.index = None
+        self.index_manifest = None
+
+    # -----------------------------
+    # Model + embeddings
+    # -----------------------------
+
+    def model(self):
+        """
+        (processor, model, device, settings), loaded on first use. settings are the
+        backend / image loader settings that go into the cache key and the index header.
+        """
+        if self._model is None:
+            import torch
+
+            import embedding_engine
+            import image_loader
+            import inference_backends
+            from embedding_cache import EmbeddingCache
+
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            print("Device:", device)
+            with self.stats.stage("load_model"):
+                processor, model = embedding_engine.load_model(
+                    self.config["model_name"], device, backend=self.config["inference_backend"])
+            # Embeddings differ slightly per backend / loader: keep them apart in the cache and the index
+            mode = self.config["image_loader"]
+            settings = image_loader.merge_settings(
+                inference_backends.backend_settings(self.config["inference_backend"]),
+                image_loader.loader_settings(mode))
+            self._model = (processor, model, device, settings)
+            if self.config["embedding_cache_dir"]:
+                self.embedding_cache = EmbeddingCache(self.config["model_name"], processor,
+                                                      cache_dir=self.config["embedding_cache_dir"],
+                                                      extra=settings)
+                print(f"Embedding cache: {self.embedding_cache.dir} ({len(self.embedding_cache)} images)")
+            if mode != "full" or self.config["pixel_cache_dir"]:
+                # The pixel cache uses the embedding cache's file hashes: one sha1 per file
+                hashes = self.embedding_cache.hashes if self.embedding_cache else None
+                self.loader = image_loader.ImageLoader(processor, mode, self.config["pixel_cache_dir"], hashes)
+        return self._model
+
+    def compute_image_embeddings(self, image_paths):
+        # Row i of the result belongs to image_paths[i] (zero row if the image failed)
+        import embedding_engine
+
+        processor, model, device, _ = self.model()
+        return embedding_engine.compute_image_embeddings(
+            image_paths, processor, model, device,
+            batch_size=self.config["embed_batch_size"],
+            num_workers=self.config["embed_workers"],
+            prefetch_batches=self.config["embed_prefetch"],
+            cache=self.embedding_cache,
+            loader=self.loader,
+        )
+
+    def nk_images(self):
+        """
+        (DataFrame of the NK CSV rows whose image exists, their image paths).
+        """
+        import pandas as pd
+
+        df_csv1 = pd.read_csv(self.config["csv1_path"])
+        if "reproduction.path" not in df_csv1.columns:
+            raise ValueError("Column 'reproduction.path' not found in CSV")
+        df_csv1 = df_csv1[df_csv1["reproduction.path"].astype(str).map(os.path.exists)].reset_index(drop=True)
+        images1 = list(df_csv1["reproduction.path"].astype(str))
+        print(f"Loaded {len(images1)} NK images from CSV")
+        return df_csv1, images1
+
+    def index_files(self):
+        """
+        (FAISS index file, manifest file) of this configuration.
+        """
+        import index_types
+
+        return index_types.index_file_names(self.index_config, self.config["index_type"])
+
+    def index_header(self):
+        """
+        Recorded in the index manifest; a cached index built with other settings is rebuilt.
+        """
+        from embedding_cache import preprocessing_signature
+
+        processor, model, _, settings = self.model()
+        return {
+            "model_name": self.config["model_name"],
+            "dim": model.config.hidden_size,
+            "index_type": self.config["index_type"],
+            "preprocessing": preprocessing_signature(processor, settings),
+            "folder": self.config["dir2"],
+        }
+
+    # -----------------------------
+    # Stages
+    # -----------------------------
+
+    def index_stage(self):
+        """
+        Loads the cached index (if any) and brings it in line with the current contents of dir2.
+        """
+        import embedding_store
+        import index_sync
+
+        faiss_index_file, manifest_file = self.index_files()
+        header = self.index_header()
+        cache = self.embedding_cache
+        file_hash = cache.file_hash if cache else index_sync.sha1_of_file
+        print("Loading FAISS index...")
+        with self.stats.stage("load_index"):
+            index, manifest = index_sync.load_index(faiss_index_file, manifest_file, file_hash=file_hash,
+                                                    header=header)
+        if index is None:
+            print("\nComputing DHM embeddings...")
+        with self.stats.stage("sync_index"):
+            index, manifest, changed = index_sync.sync_index(
+                index, manifest, self.config["dir2"], self.compute_image_embeddings,
+                file_hash=file_hash, index_type=self.config["index_type"], header=header,
+            )
+            if changed and index is not None:
+                index_sync.save_index(index, manifest, faiss_index_file, manifest_file)
+        if index is None or index.ntotal == 0:
+            raise RuntimeError(f"No DHM images indexed: '{self.config['dir2']}' is empty or none of its "
+                               f"images could be read")
+        self.stats.count("index_vectors", index.ntotal)
+        self.index, self.index_manifest = index, manifest
+
+        store_prefix = self.index_config + ".emb"
+        variants = tuple(self.config["store_variants"] or ())
+        if variants and cache and (changed or not embedding_store.store_exists(store_prefix)):
+            # Vectors come from the embedding cache (only images indexed before the cache existed are embedded)
+            files = manifest["files"]
+            paths = list(files)
+            with self.stats.stage("write_store", items=len(paths)):
+                embedding_store.write_store(
+                    store_prefix, paths, [files[p]["id"] for p in paths],
+                    self.compute_image_embeddings(paths), model_name=self.config["model_name"], variants=variants)
+            print(f"Embedding store written: {store_prefix}.* ({', '.join(variants)})")
+
+    def embed_stage(self):
+        """
+        Embeds the NK photos into the store nk_store_prefix (row i = i-th existing CSV row).
+        """
+        import embedding_store
+        import numpy as np
+
+        df_csv1, images1 = self.nk_images()
+        print("\nComputing NK embeddings...")
+        with self.stats.stage("embed_nk", items=len(images1)):
+            embeddings1 = self.compute_image_embeddings(images1).astype("float32")
+        embedding_store.write_store(self.nk_store_prefix, images1, np.arange(len(images1)), embeddings1,
+                                    model_name=self.config["model_name"], variants=("float32",))
+        self.stats.count("nk_images", len(images1))
+        self._nk = (df_csv1, images1, embeddings1)
+
+    def _load_index(self):
+        import index_sync
+
+        faiss_index_file, manifest_file = self.index_files()
+        # The index stage checked the preprocessing; here only what identifies the index
+        header = {"model_name": self.config["model_name"], "index_type": self.config["index_type"],
+                  "folder": self.config["dir2"]}
+        with self.stats.stage("load_index"):
+            self.index, self.index_manifest = index_sync.load_index(faiss_index_file, manifest_file, header=header)
+        if self.index is None:
+            raise RuntimeError(f"No usable index {faiss_index_file}; run 'nk_matcher.py index' first")
+
+    def _load_nk(self):
+        import embedding_store
+
+        df_csv1, images1 = self.nk_images()
+        if not embedding_store.store_exists(self.nk_store_prefix):
+            raise RuntimeError(f"No NK embeddings {self.nk_store_prefix}; run 'nk_matcher.py embed' first")
+        store = embedding_store.EmbeddingStore(self.nk_store_prefix)
+        if store.header["model_name"] != self.config["model_name"] or store.paths != images1:
+            raise RuntimeError(f"{self.nk_store_prefix} doesn't match {self.config['csv1_path']} / "
+                               f"{self.config['model_name']}; run 'nk_matcher.py embed' again")
+        self._nk = (df_csv1, images1, store.rows(slice(None)))
+
+    def search(self, embeddings, images, object_numbers, k):
+        """
+        Searches the loaded index with embeddings (row i = photo images[i]) as configured:
+        search_mode, rerank_top_n and group_by_dhm_base. Returns (source_rows, D, I) with
+        the top k per result row; source_rows[j] are the photo rows of result row j.
+        """
+        import numpy as np
+
+        import base_search
+        import index_sync
+        import index_types
+        import object_search
+
+        cfg = self.config
+        index = self.index
+        idx_to_path = index_sync.idx_to_path_of(self.index_manifest)
+        index_types.set_search_params(index, nprobe=cfg["ivf_nprobe"], ef_search=cfg["hnsw_ef_search"])
+        if embeddings.shape[1] != index.d:
+            raise RuntimeError(f"NK embeddings have {embeddings.shape[1]} dims, the index {index.d}")
+
+        print("Performing FAISS search...")
+        k = min(k, index.ntotal)
+        # Grouped search over-fetches, so enough distinct DHM bases remain after collapsing
+        k_search = base_search.fetch_k(k, index.ntotal, cfg["group_overfetch"]) if cfg["group_by_dhm_base"] else k
+        with self.stats.stage("faiss_search", items=len(images)):
+            if cfg["search_mode"] == "object":
+                # One merged result list per object_number, from all its photos
+                object_groups, D, I = object_search.search_objects(
+                    index, embeddings, object_numbers, k_search, mode=cfg["object_fusion"])
+                source_rows = list(object_groups.values())
+                print(f"Searched {len(source_rows)} objects ({len(images)} photos, fusion: {cfg['object_fusion']})")
+            else:
+                D, I = index.search(np.ascontiguousarray(embeddings, dtype="float32"), k_search)
+                source_rows = [[i] for i in range(len(images))]
+
+        if cfg["rerank_top_n"]:
+            import patch_rerank
+
+            processor, model, device, settings = self.model()
+            reranker = patch_rerank.PatchReranker(
+                processor, model, device, cfg["model_name"],
+                cache_dir=cfg["embedding_cache_dir"] or patch_rerank.CACHE_DIR,
+                top_n=cfg["rerank_top_n"], weight=cfg["rerank_patch_weight"],
+                batch_size=cfg["embed_batch_size"], num_workers=cfg["embed_workers"], extra=settings,
+                loader=self.loader)
+            print(f"Re-ranking top {cfg['rerank_top_n']} with patch tokens...")
+            with self.stats.stage("rerank", items=len(source_rows)):
+                D, I = reranker.rerank(D, I, [[images[r] for r in rows] for rows in source_rows], idx_to_path)
+
+        if cfg["group_by_dhm_base"]:
+            # Best-scoring crop per DHM base, top-k distinct bases
+            dhm_base_ids, _ = base_search.base_id_array(idx_to_path)
+            D, I = base_search.collapse_by_base(D, I, dhm_base_ids, k)
+        return source_rows, D, I
+
+    def search_stage(self, formats=("jsonl",)):
+        """
+        Searches the index with the NK embeddings and writes the matches in formats
+        (see match_export.FORMATS; jsonl is the input of render and export).
+        """
+        import index_sync
+        import match_export
+
+        if self.index is None:
+            self._load_index()
+        if self._nk is None:
+            self._load_nk()
+        df_csv1, images1, embeddings1 = self._nk
+
+        # Per-row metadata (row i belongs to images1[i])
+        nk_object_numbers = [str(v) for v in df_csv1.get("object_number", [""] * len(df_csv1))]
+        nk_dimensions = [str(v) for v in df_csv1.get("dimensions", [""] * len(df_csv1))]
+        nk_objectname = [str(v) for v in df_csv1.get("object_name", [""] * len(df_csv1))]
+
+        source_rows, D, I = self.search(embeddings1, images1, nk_object_numbers, self.config["results_per_item"])
+
+        # Streamed to the output files source by source (see match_export.py); the .jsonl
+        # is what render and export read
+        idx_to_path = index_sync.idx_to_path_of(self.index_manifest)
+        os.makedirs(self.output_folder, exist_ok=True)
+        records = match_export.iter_records(source_rows, images1, nk_object_numbers, nk_dimensions,
+                                            nk_objectname, D, I)
+        with self.stats.stage("write_matches", items=len(source_rows)), \
+                match_export.MatchExporter(self.matches_prefix, idx_to_path, formats) as exporter:
+            for source, pairs in records:
+                exporter.write(source, pairs)
+
+    def render_stage(self):
+        import match_export
+        import render_site
+
+        if not os.path.exists(self.matches_file):
+            raise RuntimeError(f"No matches {self.matches_file}; run 'nk_matcher.py search' first")
+        match_data = match_export.read_match_data(self.matches_file)
+        with self.stats.stage("render_site", items=len(match_data)):
+            render_site.render_site(match_data, self.html_name, self.output_folder,
+                                    workers=self.config["render_workers"], viewer=self.config["site_viewer"])
+
+    def export_stage(self):
+        import match_export
+
+        if not os.path.exists(self.matches_file):
+            raise RuntimeError(f"No matches {self.matches_file}; run 'nk_matcher.py search' first")
+        with self.stats.stage("export"):
+            match_export.convert_jsonl(self.matches_file, self.matches_prefix, self.config["export_formats"])
+
+    def run(self, command):
+        export_formats = ["jsonl"] + [f for f in self.config["export_formats"] if f != "jsonl"]
+        stages = {
+            "index": [self.index_stage],
+            "embed": [self.embed_stage],
+            "search": [self.search_stage],
+            "render": [self.render_stage],
+            "export": [self.export_stage],
+            # search writes the export formats while it produces the results
+            "run": [self.index_stage, self.embed_stage, lambda: self.search_stage(export_formats), self.render_stage],
+        }[command]
+        print(f"Config: {self.config_name}")
+        print(f"HTML output: {self.html_name}")
+        pipeline_stats.activate(self.stats)
+        profiler = pipeline_stats.start_profiler(self.config["profile"])
+        for stage in stages:
+            stage()
+
+        os.makedirs(self.output_folder, exist_ok=True)
+        report_prefix = os.path.join(self.output_folder, f"{self.html_name}_{command}")
+        pipeline_stats.stop_profiler(profiler, report_prefix)
+        self.stats.print_summary()
+        extra = {}
+        if "torch" in sys.modules:
+            torch = sys.modules["torch"]
+            extra = {"torch_version": torch.__version__, "torch_threads": torch.get_num_threads()}
+        self.stats.save_with_history(report_prefix + "_report.json", command=command, config=self.config, **extra)
+        print(f"✓ Done. All files written to '{self.output_folder}/' folder.")
+
+
+def main(argv=None):
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--config", action="append", default=[], metavar="JSON",
+                        help="JSON file with settings (see DEFAULTS); may be given more than once")
+    common.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", dest="overrides",
+                        help="override one setting, e.g. --set index_type=hnsw --set rerank_top_n=50")
+    common.add_argument("--profile", choices=pipeline_stats.PROFILERS, default=None,
+                        help="write a cProfile / torch.profiler profile of the run")
+    common.add_argument("--show-config", action="store_true", help="print the resulting settings and stop")
+
+    parser = argparse.ArgumentParser(description="Match NK photos with the DHM image set")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in [
+        ("index", "build / update the FAISS index of dir2"),
+        ("embed", "embed the NK photos of csv1_path"),
+        ("search", "search the index and save the matches JSON"),
+        ("render", "HTML site from the matches JSON"),
+        ("export", "CSV from the matches JSON"),
+        ("run", "all stages"),
+    ]:
+        commands.add_parser(name, parents=[common], help=help_text)
+    args = parser.parse_args(argv)
+
+    try:
+        config = load_config(args.config, args.overrides)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if args.profile:
+        config["profile"] = args.profile
+    if args.show_config:
+        print(json.dumps(config, indent=2))
+        return
+
+    try:
+        Matcher(config).run(args.command)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 from ultralytics import YOLO
 import cv2
 import os
+import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from tqdm import tqdm
 
@@ -20,6 +22,13 @@ OUTPUT_FOLDER = 'DHM/DHM_images_split_yolo_detect'
 # 4. Where your training config is (Keep this OUTSIDE the input_images folder)
 TRAINING_YAML = 'DHM/test/DHM_images_detect_train/training_yolo/data.yaml'
 
+# 5. Batched inference / output writing
+BATCH_SIZE = 16  # images per model.predict call
+WRITER_THREADS = 4  # threads encoding and writing crops
+
+# 6. Run manifest: which source files are done (and their boxes), so an interrupted run resumes
+RUN_MANIFEST = os.path.join(OUTPUT_FOLDER, '_run_manifest.jsonl')
+
 
 # ---------------------
 
@@ -41,6 +50,46 @@ def train_model():
     print(f"Training complete! Model saved to {MODEL_PATH}")
 
 
+def load_run_manifest():
+    """
+    Returns the set of source files that a previous (possibly interrupted) run finished.
+    """
+    done = set()
+    if not os.path.exists(RUN_MANIFEST):
+        return done
+    with open(RUN_MANIFEST, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)['source'])
+            except (ValueError, KeyError):
+                # Last line of an interrupted run may be incomplete
+                continue
+    return done
+
+
+def _write(path, img):
+    """
+    Writes an image in the writer pool. Returns False instead of raising on failure.
+    """
+    try:
+        return cv2.imwrite(path, img)
+    except Exception as e:
+        print(f"Error writing {path}: {e}")
+        return False
+
+
+def finish_batch(pending, manifest):
+    """
+    Waits for the crop writes of a batch and records the finished sources in the run manifest.
+    """
+    for entry, futures in pending:
+        if all(f.result() for f in futures):
+            manifest.write(json.dumps(entry) + "\n")
+        else:
+            print(f"Error writing output for {entry['source']}, will be retried on the next run")
+    manifest.flush()
+
+
 def process_images_with_ai():
     """
     Uses the trained model to find photos and crop them.
@@ -54,59 +103,74 @@ def process_images_with_ai():
     if not os.path.exists(OUTPUT_FOLDER):
         os.makedirs(OUTPUT_FOLDER)
 
-    # Get a list of images just for the progress bar count
-    # YOLO handles the actual loading, but we want to know how many total files there are.
+    # Collect the input images, skipping the ones a previous run already finished
     image_extensions = ['*.jpg', '*.jpeg', '*.png', '*.bmp', '*.tif']
-    total_files = 0
     input_path = Path(INPUT_FOLDER)
-    for ext in image_extensions:
-        total_files += len(list(input_path.glob(ext)))
-
-    print(f"Found ~{total_files} images in {INPUT_FOLDER}. Starting inference...")
-
-    # Run inference
-    # stream=True returns a python generator (memory efficient)
-    results = model.predict(source=INPUT_FOLDER, stream=True, conf=0.5, iou=0.7)
-
-    # Wrap results in tqdm for a progress bar
-    for result in tqdm(results, total=total_files, desc="Processing"):
-
-        path = Path(result.path)
-        img = result.orig_img
-
-        # Always write copy of original to results
-        save_name = f"{path.stem}.jpg"
-        cv2.imwrite(os.path.join(OUTPUT_FOLDER, save_name), img)
-
-        # If no detections, skip
-        if len(result.boxes) == 0:
-            continue
-
-        # Iterate through detected boxes
-        for i, box in enumerate(result.boxes):
-            try:
-                # Get coordinates
-                coords = box.xyxy[0].cpu().numpy().astype(int)
-                x1, y1, x2, y2 = coords
-
-                # Safety clamp (ensure we don't crop outside image boundaries)
-                h, w, _ = img.shape
-                x1, y1 = max(0, x1), max(0, y1)
-                x2, y2 = min(w, x2), min(h, y2)
-
-                crop = img[y1:y2, x1:x2]
-
-                # Save
-                save_name_crop = f"{path.stem}_{i}.jpg"
-                # if len(result.boxes) > 1:
-                #     save_name = f"{path.stem}_{i}.jpg"
-                # else:
-                #     save_name = f"{path.stem}.jpg"
-
-                cv2.imwrite(os.path.join(OUTPUT_FOLDER, save_name_crop), crop)
-
-            except Exception as e:
-                print(f"Error saving crop for {path.name}: {e}")
+    all_files = sorted({p for ext in image_extensions for p in input_path.glob(ext)})
+    done = load_run_manifest()
+    todo = [p for p in all_files if str(p) not in done]
+
+    print(f"Found {len(all_files)} images in {INPUT_FOLDER}, {len(all_files) - len(todo)} already done. "
+          f"Starting inference on {len(todo)}...")
+
+    # Crops are encoded/written by a thread pool while the model works on the next batch.
+    # A source file is only marked done in the run manifest once all its outputs are written.
+    pending = []
+    with ThreadPoolExecutor(max_workers=WRITER_THREADS) as writer, \
+            open(RUN_MANIFEST, 'a', encoding='utf-8') as manifest:
+        for start in tqdm(range(0, len(todo), BATCH_SIZE), desc="Processing (batches)"):
+            batch = [str(p) for p in todo[start:start + BATCH_SIZE]]
+            results = model.predict(source=batch, conf=0.5, iou=0.7, batch=BATCH_SIZE, verbose=False)
+
+            # Previous batch has had the whole predict call to finish writing
+            finish_batch(pending, manifest)
+            pending = []
+
+            for source, result in zip(batch, results):
+                path = Path(result.path)
+                img = result.orig_img
+                entry = {"source": source, "boxes": [], "outputs": []}
+                futures = []
+
+                # Always write copy of original to results
+                save_name = f"{path.stem}.jpg"
+                futures.append(writer.submit(_write, os.path.join(OUTPUT_FOLDER, save_name), img))
+                entry["outputs"].append(save_name)
+
+                # If no detections, skip
+                if len(result.boxes) == 0:
+                    pending.append((entry, futures))
+                    continue
+
+                # Iterate through detected boxes
+                for i, box in enumerate(result.boxes):
+                    try:
+                        # Get coordinates
+                        coords = box.xyxy[0].cpu().numpy().astype(int)
+                        x1, y1, x2, y2 = coords
+
+                        # Safety clamp (ensure we don't crop outside image boundaries)
+                        h, w, _ = img.shape
+                        x1, y1 = max(0, x1), max(0, y1)
+                        x2, y2 = min(w, x2), min(h, y2)
+                        if x2 <= x1 or y2 <= y1:
+                            print(f"Skipping empty crop {i} for {path.name}")
+                            continue
+
+                        crop = img[y1:y2, x1:x2]
+
+                        # Save in the background
+                        save_name_crop = f"{path.stem}_{i}.jpg"
+                        futures.append(writer.submit(_write, os.path.join(OUTPUT_FOLDER, save_name_crop), crop))
+                        entry["boxes"].append([int(x1), int(y1), int(x2), int(y2)])
+                        entry["outputs"].append(save_name_crop)
+
+                    except Exception as e:
+                        print(f"Error saving crop for {path.name}: {e}")
+
+                pending.append((entry, futures))
+
+        finish_batch(pending, manifest)
 
 
 if __name__ == "__main__":
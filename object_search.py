@@ -0,0 +1,97 @@
+# object_search.py
+# Object-level search: one merged result list per NK object instead of one per photo.
+#
+# Fusion modes:
+#   mean       average the (normalised) photo embeddings, one FAISS query per object
+#   max        element-wise max of the photo embeddings, one FAISS query per object
+#   score_max  search all photos in one batched call, rank DHM images by their best score
+#   rrf        search all photos in one batched call, reciprocal-rank fusion of the lists
+#
+# In every mode the returned similarity is a cosine similarity (for rrf: the best one
+# any photo of the object reached), so it can be shown in the viewer as before.
+from collections import OrderedDict
+
+import numpy as np
+
+FUSION_MODES = ("mean", "max", "score_max", "rrf")
+RRF_K = 60  # standard reciprocal-rank-fusion constant
+
+
+def group_rows(keys):
+    """
+    key -> list of row numbers, in order of first appearance.
+    """
+    groups = OrderedDict()
+    for row, key in enumerate(keys):
+        groups.setdefault(key, []).append(row)
+    return groups
+
+
+def fuse_embeddings(embs, groups, mode="mean"):
+    """
+    One L2-normalised vector per group. Zero rows (failed images) are ignored.
+    """
+    fused = np.zeros((len(groups), embs.shape[1]), dtype="float32")
+    for g, rows in enumerate(groups.values()):
+        vecs = embs[rows]
+        vecs = vecs[np.linalg.norm(vecs, axis=1) > 0]
+        if not len(vecs):
+            continue
+        v = vecs.mean(axis=0) if mode == "mean" else vecs.max(axis=0)
+        fused[g] = v / np.linalg.norm(v)
+    return fused
+
+
+def _aggregate(D, I, rows, k, mode):
+    ids = I[rows].ravel()
+    sims = D[rows].ravel()
+    valid = ids >= 0
+    ids, sims = ids[valid], sims[valid]
+    if not len(ids):
+        return np.full(k, -1, dtype="int64"), np.zeros(k, dtype="float32")
+
+    uniq, inverse = np.unique(ids, return_inverse=True)
+    best = np.full(len(uniq), -np.inf, dtype="float32")
+    np.maximum.at(best, inverse, sims)
+    if mode == "rrf":
+        ranks = np.tile(np.arange(I.shape[1]), len(rows))[valid]
+        score = np.bincount(inverse, weights=1.0 / (RRF_K + ranks + 1), minlength=len(uniq))
+    else:
+        score = best
+    order = np.argsort(-score, kind="stable")[:k]
+
+    out_i = np.full(k, -1, dtype="int64")
+    out_d = np.zeros(k, dtype="float32")
+    out_i[:len(order)] = uniq[order]
+    out_d[:len(order)] = best[order]
+    return out_i, out_d
+
+
+def search_objects(index, embs, object_keys, k, mode="mean"):
+    """
+    Searches index once per object (object_keys[i] is the object of row i of embs).
+    Returns (groups, D, I) with one row of D/I per group, in groups order.
+    """
+    if mode not in FUSION_MODES:
+        raise ValueError(f"Unknown fusion mode '{mode}', choose from {FUSION_MODES}")
+    groups = group_rows(object_keys)
+    embs = np.ascontiguousarray(embs, dtype="float32")
+    ok = np.linalg.norm(embs, axis=1) > 0  # zero rows are photos that failed to embed
+
+    if mode in ("mean", "max"):
+        fused = fuse_embeddings(embs, groups, mode)
+        D, I = index.search(fused, k)
+        I[np.linalg.norm(fused, axis=1) == 0] = -1  # no usable photo: no matches
+        return groups, D, I
+
+    # One batched search for the photos that embedded, then merge per object; failed
+    # photos keep -1 ids, so they add nothing to the fused lists
+    D_all = np.zeros((len(embs), k), dtype="float32")
+    I_all = np.full((len(embs), k), -1, dtype="int64")
+    if ok.any():
+        D_all[ok], I_all[ok] = index.search(embs[ok], k)
+    D = np.zeros((len(groups), k), dtype="float32")
+    I = np.full((len(groups), k), -1, dtype="int64")
+    for g, rows in enumerate(groups.values()):
+        I[g], D[g] = _aggregate(D_all, I_all, rows, k, mode)
+    return groups, D, I
@@ -0,0 +1,127 @@
+# patch_rerank.py
+# Second search stage: re-ranks the top-N FAISS candidates with patch-level similarity.
+#
+# The global embedding is the mean of all patch tokens, so a crop, a partial view or a
+# differently framed photo of the same object can end up far from the original. Here
+# each image is described by its patch tokens instead, compressed to a PATCH_GRID x
+# PATCH_GRID grid (adaptive average pooling) of PATCH_DIM-dim vectors (fixed random
+# projection, float16): 64 x 128 values per image instead of 256 x 1024. Two images
+# are compared by counting mutual nearest neighbours between their tokens.
+#
+# Patch tokens are computed only for images that show up as candidates (or queries)
+# and are kept in the embedding cache under their own namespace, so every image is
+# processed once. Per query the work is bounded: top_n candidates of 64 x 64 token
+# similarities each.
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+import embedding_engine
+from embedding_cache import CACHE_DIR, EmbeddingCache
+
+RERANK_TOP_N = 50     # candidates per query that are re-ranked
+PATCH_WEIGHT = 0.5    # final score = (1 - w) * global cosine + w * mutual-NN score
+PATCH_GRID = 8        # tokens per side after pooling
+PATCH_DIM = 128       # dims per token after projection
+MIN_TOKEN_SIM = 0.3   # mutual neighbours below this cosine don't count
+PROJECTION_SEED = 0
+ROW_CHUNK = 256       # queries whose tokens are held in memory at the same time
+
+
+class PatchReranker:
+    """
+    Re-ranks FAISS results with mutual-nearest-neighbour counting over patch tokens.
+    """
+
+    def __init__(self, processor, model, device, model_name, cache_dir=CACHE_DIR, top_n=RERANK_TOP_N,
+                 weight=PATCH_WEIGHT, batch_size=embedding_engine.BATCH_SIZE, num_workers=embedding_engine.NUM_WORKERS,
+                 extra=None, loader=None):
+        self.processor = processor
+        self.model = model
+        self.device = device
+        self.top_n = top_n
+        self.weight = weight
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.loader = loader
+        self.n_tokens = PATCH_GRID * PATCH_GRID
+        rng = np.random.default_rng(PROJECTION_SEED)
+        hidden = model.config.hidden_size
+        self.projection = torch.from_numpy(
+            (rng.standard_normal((hidden, PATCH_DIM)) / np.sqrt(PATCH_DIM)).astype("float32"))
+        settings = {"patch_grid": PATCH_GRID, "patch_dim": PATCH_DIM, "seed": PROJECTION_SEED, **(extra or {})}
+        self.cache = EmbeddingCache(model_name, processor, cache_dir=cache_dir, extra=settings, dtype="float16")
+
+    def _embed_patches(self, model, pixel_values, device):
+        """
+        embed_fn for embedding_engine: (B, n_tokens * PATCH_DIM) compressed patch tokens.
+        """
+        with torch.no_grad():
+            hidden = model(pixel_values=torch.from_numpy(pixel_values).to(device)).last_hidden_state.float().cpu()
+        # Drop the CLS token (and register tokens, if the model has them)
+        n_skip = 1 + getattr(model.config, "num_register_tokens", 0)
+        tokens = hidden[:, n_skip:]
+        b, n, d = tokens.shape
+        side = int(round(n ** 0.5))
+        grid = tokens.transpose(1, 2).reshape(b, d, side, side)
+        pooled = F.adaptive_avg_pool2d(grid, PATCH_GRID).flatten(2).transpose(1, 2)  # (B, T, d)
+        projected = F.normalize(pooled @ self.projection, dim=-1)
+        return projected.reshape(b, -1).numpy()
+
+    def tokens(self, paths, desc="Patch tokens"):
+        """
+        (len(paths), n_tokens, PATCH_DIM) float32 tokens; all-zero for images that failed.
+        """
+        flat = embedding_engine.compute_image_embeddings(
+            paths, self.processor, self.model, self.device,
+            batch_size=self.batch_size, num_workers=self.num_workers, desc=desc,
+            cache=self.cache, embed_fn=self._embed_patches, dim=self.n_tokens * PATCH_DIM, loader=self.loader)
+        return flat.reshape(len(paths), self.n_tokens, PATCH_DIM)
+
+    @staticmethod
+    def mutual_nn_scores(query, candidates):
+        """
+        query (T, d), candidates (N, T, d) -> (N,) share of query tokens that are
+        mutual nearest neighbours with a candidate token (similarity >= MIN_TOKEN_SIM).
+        """
+        sims = np.einsum("qd,ntd->nqt", query, candidates)        # (N, Tq, Tc)
+        q_to_c = sims.argmax(axis=2)                                # best candidate token per query token
+        c_to_q = sims.argmax(axis=1)                                # best query token per candidate token
+        back = np.take_along_axis(c_to_q, q_to_c, axis=1)           # (N, Tq)
+        mutual = back == np.arange(query.shape[0])[None, :]
+        strong = np.take_along_axis(sims, q_to_c[:, :, None], axis=2)[:, :, 0] >= MIN_TOKEN_SIM
+        return (mutual & strong).mean(axis=1)
+
+    def rerank(self, D, I, query_paths, idx_to_path):
+        """
+        Re-orders the first top_n results of every row of (D, I). query_paths[row] is the
+        list of source images of that row (one photo, or all photos of an object; the
+        best-matching photo counts). Returns new (D, I) in the new order; D keeps the
+        global cosine similarities, so displayed scores keep their meaning.
+        """
+        D, I = D.copy(), I.copy()
+        n = min(self.top_n, I.shape[1])
+        if n == 0:
+            return D, I
+
+        # Rows in chunks: tokens of a chunk's queries + candidates are loaded together
+        # (cached, so each image is processed only once), memory stays bounded
+        for start in range(0, len(I), ROW_CHUNK):
+            rows = range(start, min(start + ROW_CHUNK, len(I)))
+            queries = sorted({p for row in rows for p in query_paths[row]})
+            candidate_ids = sorted({int(i) for i in I[start:rows.stop, :n].ravel() if i >= 0})
+            q_tokens = dict(zip(queries, self.tokens(queries, desc="Patch tokens (queries)")))
+            c_tokens = dict(zip(candidate_ids, self.tokens([idx_to_path[i] for i in candidate_ids],
+                                                           desc="Patch tokens (candidates)")))
+            for row in rows:
+                ids = I[row, :n]
+                valid = ids >= 0
+                if not valid.any():
+                    continue
+                cands = np.stack([c_tokens[int(i)] for i in ids[valid]])
+                patch = np.max([self.mutual_nn_scores(q_tokens[p], cands) for p in query_paths[row]], axis=0)
+                combined = (1 - self.weight) * D[row, :n][valid] + self.weight * patch
+                order = np.argsort(-combined, kind="stable")
+                D[row, :n][valid] = D[row, :n][valid][order]
+                I[row, :n][valid] = ids[valid][order]
+        return D, I
@@ -0,0 +1,208 @@
+# pipeline_stats.py
+# Wall time, item counts and memory per pipeline stage, saved as a JSON report.
+#
+# Library code records stages through timed(), which goes to the RunStats made active
+# with activate() (and does nothing when there is none), so e.g. embedding_engine can
+# report decode / preprocess / forward times without a stats argument on every call.
+# Stages timed in worker threads add up the time of all threads.
+#
+# Optional profiling of a whole run: start_profiler("cprofile" or "torch") and
+# stop_profiler() write the profile next to the run report.
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process in MB (None if unavailable).
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class RunStats:
+    """
+    Collects per-stage timings. Use as:
+
+        stats = RunStats()
+        with stats.stage("search", items=len(queries)):
+            ...
+        stats.save("report.json", config={...})
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, items=None):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0, items)
+
+    def add(self, name, seconds, items=None):
+        with self.lock:
+            s = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0, "items": 0})
+            s["seconds"] += seconds
+            s["calls"] += 1
+            if items is not None:
+                s["items"] += items
+            s["peak_rss_mb_after"] = peak_rss_mb()
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        stages = {}
+        for name, s in self.stages.items():
+            entry = dict(s)
+            entry["seconds"] = round(s["seconds"], 3)
+            if s["items"] and s["seconds"] > 0:
+                entry["items_per_sec"] = round(s["items"] / s["seconds"], 2)
+            stages[name] = entry
+        return {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "total_seconds": round(time.time() - self.started, 3),
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": stages,
+            "counters": dict(self.counters),
+        }
+
+    def print_summary(self):
+        print(f"\n{'stage':<24}{'seconds':>10}{'items':>10}{'items/s':>10}")
+        for name, s in self.report()["stages"].items():
+            print(f"{name:<24}{s['seconds']:>10}{s['items'] or '':>10}{s.get('items_per_sec', ''):>10}")
+        print(f"Peak RSS: {peak_rss_mb()} MB")
+
+    def save(self, path, **extra):
+        data = dict(extra)
+        data["run"] = self.report()
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+
+    def save_with_history(self, path, **extra):
+        """
+        Saves the report to path, appends it to run_history.jsonl next to it and prints
+        the stages that got more than 20% slower or faster than in the previous report.
+        """
+        previous = None
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                previous = json.load(f).get("run")
+        self.save(path, **extra)
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        with open(os.path.join(os.path.dirname(path) or ".", "run_history.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps(data) + "\n")
+        if previous:
+            print_changes(previous, data["run"])
+
+
+def print_changes(previous, current, threshold=0.2):
+    changes = []
+    for name, s in current["stages"].items():
+        before = previous.get("stages", {}).get(name, {}).get("seconds")
+        if before and before > 0.5 and abs(s["seconds"] - before) / before > threshold:
+            changes.append(f"  {name:<24}{before:>10.2f}s -> {s['seconds']:.2f}s")
+    if changes:
+        print("Stages that changed more than 20% since the previous run:")
+        print("\n".join(changes))
+
+
+# -----------------------------
+# Active run (for library code)
+# -----------------------------
+
+_active = None
+
+
+def activate(stats):
+    global _active
+    _active = stats
+
+
+def timed(name, items=None):
+    """
+    Stage of the active RunStats, or a no-op context if none is active.
+    """
+    return _active.stage(name, items) if _active is not None else nullcontext()
+
+
+def count(name, n=1):
+    if _active is not None:
+        _active.count(name, n)
+
+
+# -----------------------------
+# Profilers
+# -----------------------------
+
+PROFILERS = ("cprofile", "torch")
+
+
+def start_profiler(kind):
+    """
+    Starts a "cprofile" or "torch" (torch.profiler, CPU + CUDA) profiler; None = off.
+    """
+    if not kind:
+        return None
+    if kind == "cprofile":
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return kind, profiler
+    if kind == "torch":
+        import torch
+
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        profiler = torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True)
+        profiler.__enter__()
+        return kind, profiler
+    raise ValueError(f"Unknown profiler '{kind}', choose from {PROFILERS}")
+
+
+def stop_profiler(handle, output_prefix):
+    """
+    Stops the profiler and writes <output_prefix>.prof + _profile.txt (cprofile) or
+    _trace.json (chrome://tracing / Perfetto) + _profile.txt (torch).
+    """
+    if handle is None:
+        return
+    kind, profiler = handle
+    if kind == "cprofile":
+        import io
+        import pstats
+
+        profiler.disable()
+        profiler.dump_stats(output_prefix + ".prof")
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(40)
+        with open(output_prefix + "_profile.txt", "w", encoding="utf-8") as f:
+            f.write(text.getvalue())
+        print(f"Profile written to {output_prefix}.prof (+ _profile.txt)")
+    else:
+        profiler.__exit__(None, None, None)
+        profiler.export_chrome_trace(output_prefix + "_trace.json")
+        with open(output_prefix + "_profile.txt", "w", encoding="utf-8") as f:
+            f.write(profiler.key_averages().table(sort_by="self_cpu_time_total", row_limit=40))
+        print(f"Profile written to {output_prefix}_trace.json (+ _profile.txt)")
@@ -0,0 +1,273 @@
+# query_server.py
+# Long-running local HTTP service: keeps the model and the FAISS index of the DHM set
+# loaded and answers "which DHM images match this photo?" in milliseconds.
+#
+# Concurrent requests are micro-batched: the batcher thread takes whatever is queued
+# (up to MAX_BATCH requests, waiting at most MAX_WAIT_MS for more) and runs one
+# forward pass and one index.search for all of them.
+#
+# Endpoints:
+#   POST /match?k=20[&group=1]   body: the image file (any Content-Type but JSON), or
+#                                JSON {"path": "<image on this machine>", "k": 20, "group": true}
+#   GET  /metrics                latency percentiles, queue depth, batch sizes, counters
+#   GET  /health
+#
+# Example:
+#   python query_server.py --config configs/dinov2_base.json
+#   curl --data-binary @NK_collectie/images_remove_frame/NK1234.jpg "http://127.0.0.1:8765/match?k=10"
+#
+# Model, backend, image loader and index come from the nk_matcher settings (--config /
+# --set); the index is the one nk_matcher.py index built with them, run that first.
+import argparse
+import io
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from PIL import Image
+
+import base_search
+import embedding_engine
+import index_sync
+import index_types
+import nk_matcher
+
+# --- CONFIGURATION ---
+HOST = "127.0.0.1"  # local only: /match also accepts paths on this machine
+PORT = 8765
+DEFAULT_K = 20
+MAX_K = 1000
+MAX_BATCH = 32      # requests per forward pass / search call
+MAX_WAIT_MS = 10    # how long the batcher waits for more requests after the first one
+PREPROCESS_WORKERS = 4
+LATENCY_WINDOW = 1000  # requests kept for the latency percentiles
+# ---------------------
+
+
+class Metrics:
+    """
+    Thread-safe counters + a sliding window of request latencies.
+    """
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.lock = threading.Lock()
+        self.latencies_ms = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.started = time.time()
+
+    def record_batch(self, size):
+        with self.lock:
+            self.batches += 1
+            self.batch_sizes.append(size)
+
+    def record_request(self, latency_ms, ok=True):
+        with self.lock:
+            self.requests += 1
+            self.errors += 0 if ok else 1
+            self.latencies_ms.append(latency_ms)
+
+    def snapshot(self, queue_depth):
+        with self.lock:
+            lat = np.array(self.latencies_ms) if self.latencies_ms else np.zeros(1)
+            return {
+                "uptime_s": round(time.time() - self.started, 1),
+                "requests": self.requests,
+                "errors": self.errors,
+                "batches": self.batches,
+                "queue_depth": queue_depth,
+                "mean_batch_size": round(float(np.mean(self.batch_sizes)), 2) if self.batch_sizes else 0.0,
+                "latency_ms_p50": round(float(np.percentile(lat, 50)), 2),
+                "latency_ms_p95": round(float(np.percentile(lat, 95)), 2),
+                "latency_ms_p99": round(float(np.percentile(lat, 99)), 2),
+            }
+
+
+class MicroBatcher:
+    """
+    Collects (image, k, group) requests from the HTTP threads and answers them in batches.
+    """
+
+    def __init__(self, processor, model, device, index, idx_to_path, metrics, loader=None):
+        self.processor = processor
+        self.loader = loader
+        self.model = model
+        self.device = device
+        self.index = index
+        self.idx_to_path = idx_to_path
+        self.base_ids, _ = base_search.base_id_array(idx_to_path)
+        self.metrics = metrics
+        self.queue = queue.Queue()
+        self.pool = ThreadPoolExecutor(max_workers=PREPROCESS_WORKERS)  # decode + preprocess
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, image, k, group):
+        future = Future()
+        self.queue.put((image, k, group, future))
+        return future
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + MAX_WAIT_MS / 1000
+        while len(batch) < MAX_BATCH:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._answer(batch)
+            except Exception as e:
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _answer(self, batch):
+        self.metrics.record_batch(len(batch))
+        arrays = list(self.pool.map(lambda req: embedding_engine.prepare_image(self.processor, req[0], self.loader), batch))
+        ok = [i for i, a in enumerate(arrays) if a is not None]
+        for i, (*_, future) in enumerate(batch):
+            if arrays[i] is None:
+                future.set_exception(ValueError("Image could not be read"))
+        if not ok:
+            return
+
+        embs = embedding_engine.embed_pixel_values(self.model, np.stack([arrays[i] for i in ok]), self.device)
+        # One search for the whole batch, with the largest k asked for
+        k_max = max(batch[i][1] for i in ok)
+        fetch = base_search.fetch_k(k_max, self.index.ntotal) if any(batch[i][2] for i in ok) else k_max
+        D, I = self.index.search(np.ascontiguousarray(embs, dtype="float32"), min(fetch, self.index.ntotal))
+
+        for row, i in enumerate(ok):
+            _, k, group, future = batch[i]
+            d, ids = D[row:row + 1], I[row:row + 1]
+            if group:
+                d, ids = base_search.collapse_by_base(d, ids, self.base_ids, k)
+            future.set_result([self._match(idx, sim) for idx, sim in zip(ids[0][:k], d[0][:k]) if idx >= 0])
+
+    def _match(self, idx, sim):
+        path = self.idx_to_path[int(idx)]
+        base = index_sync.dhm_base(path)
+        return {
+            "path": path,
+            "base": base,
+            "similarity": round(float(sim), 4),
+            "url": f"https://www.dhm.de/datenbank/ccp/dhm_ccp_add.php?seite=6&fld_1={base}&suchen=Suchen",
+        }
+
+
+class Handler(BaseHTTPRequestHandler):
+    batcher = None
+    metrics = None
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/metrics":
+            self._send_json(200, self.metrics.snapshot(self.batcher.queue.qsize()))
+        elif path == "/health":
+            self._send_json(200, {"status": "ok", "index_vectors": int(self.batcher.index.ntotal)})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/match":
+            self._send_json(404, {"error": "not found"})
+            return
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                request = json.loads(body)
+                params.update({key: request[key] for key in ("k", "group") if key in request})
+                image = request["path"]
+            else:
+                image = Image.open(io.BytesIO(body))
+            k = max(1, min(int(params.get("k", DEFAULT_K)), MAX_K))
+            group = str(params.get("group", "")).lower() in ("1", "true", "yes")
+            matches = self.batcher.submit(image, k, group).result()
+            ok = True
+            self._send_json(200, {"matches": matches,
+                                  "latency_ms": round((time.perf_counter() - t0) * 1000, 2)})
+        except (ValueError, KeyError, OSError) as e:
+            self._send_json(400, {"error": str(e)})
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+        finally:
+            self.metrics.record_request((time.perf_counter() - t0) * 1000, ok)
+
+    def log_message(self, format, *args):
+        pass  # one line per request is too much; see /metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP service matching photos against the DHM index")
+    parser.add_argument("--config", action="append", default=[], metavar="JSON", help="nk_matcher settings")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", dest="overrides")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+    try:
+        config = nk_matcher.load_config(args.config, args.overrides)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    # Same model, backend, image loader and index files as the matcher
+    matcher = nk_matcher.Matcher(config)
+    processor, model, device, _ = matcher.model()
+    faiss_index_file, manifest_file = matcher.index_files()
+    index, manifest = index_sync.load_index(faiss_index_file, manifest_file, header=matcher.index_header())
+    if index is None:
+        print(f"Error: no usable index {faiss_index_file}. Run 'nk_matcher.py index' with the same settings first.")
+        return
+    index_types.set_search_params(index, nprobe=config["ivf_nprobe"], ef_search=config["hnsw_ef_search"])
+    print(f"Index: {faiss_index_file} ({index.ntotal} vectors)")
+
+    # Warm-up, so the first request doesn't pay for CUDA / kernel initialisation
+    embedding_engine.embed_pixel_values(
+        model, embedding_engine.prepare_image(processor, Image.new("RGB", (224, 224)), matcher.loader)[None], device)
+
+    metrics = Metrics()
+    Handler.metrics = metrics
+    Handler.batcher = MicroBatcher(processor, model, device, index, index_sync.idx_to_path_of(manifest), metrics,
+                                   loader=matcher.loader)
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f"Listening on http://{args.host}:{args.port} (POST /match, GET /metrics)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping.")
+    finally:
+        server.server_close()
+        # Pixel-cache rows not yet flushed and the file hashes would be lost otherwise
+        if matcher.loader is not None:
+            matcher.loader.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+# render_site.py
+# Static HTML site for a matcher run: one page per NK object base + index page.
+#
+# Pages are rendered in worker processes. A build state file in the output folder
+# records a hash of every page's input (its matches, navigation, the list of all
+# bases and the template), so a rebuild only writes pages whose input changed and
+# removes pages of bases that are gone.
+#
+# VIEWER = "data" writes a data-driven viewer instead of one page per base: a single
+# viewer.html, data/bases.js with the list of bases, and the matches of each base in
+# data/objects/<base>.js, loaded on demand by viewer.js. Nothing is repeated per page,
+# so the output grows linearly with the collection, and the shared files are
+# requested with a content hash (?v=...) so browsers can keep them cached.
+#
+# Cards show thumbnails from the shared, content-addressed cache in thumbnails.py;
+# the full-resolution file is only loaded by the preview overlays.
+#
+# Runs on its own from the matches the matcher saves, e.g. after a template or CSS fix:
+#   python render_site.py dinov2-large_DHM_images_split_yolo_detect_images_to_match/dinov2-large_DHM_images_split_yolo_detect_images_to_match_matches.jsonl
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from jinja2 import Template
+
+import pipeline_stats
+import thumbnails
+
+TEMPLATE_FILE = "template.html"
+INDEX_TEMPLATE_FILE = "index_template.html"
+VIEWER_TEMPLATE_FILE = "viewer_template.html"
+STATIC_FILES = ["styles.css", "script.js", "viewer.js"]
+STATE_FILE = ".render_state.json"
+DATA_STATE_FILE = ".render_state_data.json"
+VIEWER = "pages"  # "pages": one HTML page per base, "data": viewer.html + per-object data files
+WORKERS = None  # None = one per CPU
+CHUNK_PAGES = 50  # pages per worker task
+THUMBNAILS = True  # False = cards load the original images
+
+_template = None
+_all_bases_json = None
+
+
+def get_safe_base(b_name):
+    return b_name.replace("/", "_").replace("\\", "_")
+
+
+def _sha1(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _init_worker(template_source, all_bases_json):
+    global _template, _all_bases_json
+    _template = Template(template_source)
+    _all_bases_json = all_bases_json
+
+
+def _render_chunk(pages):
+    """
+    Worker: renders and writes [(filepath, context), ...]. Returns the no of pages written.
+    """
+    for filepath, context in pages:
+        html = _template.render(all_bases_json=_all_bases_json, **context)
+        tmp = filepath + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(html)
+        os.replace(tmp, filepath)
+    return len(pages)
+
+
+def _executor(workers, template_source, all_bases_json):
+    """
+    Worker processes via fork, so the calling script (e.g. the matcher, which runs at
+    module level) is not imported again in every worker. Where fork is unavailable
+    (Windows) threads are used instead.
+    """
+    if "fork" in multiprocessing.get_all_start_methods():
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"),
+                                   initializer=_init_worker, initargs=(template_source, all_bases_json))
+    return ThreadPoolExecutor(max_workers=workers or os.cpu_count(),
+                              initializer=_init_worker, initargs=(template_source, all_bases_json))
+
+
+def load_state(output_folder, state_file=STATE_FILE):
+    path = os.path.join(output_folder, state_file)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def save_state(output_folder, state, state_file=STATE_FILE):
+    path = os.path.join(output_folder, state_file)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+def _short_hash(text):
+    return _sha1(text)[:12]
+
+
+def _file_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def copy_static_files(output_folder):
+    for file in STATIC_FILES:
+        if not os.path.exists(file):
+            continue
+        target = os.path.join(output_folder, file)
+        if os.path.exists(target) and _file_bytes(target) == _file_bytes(file):
+            continue
+        shutil.copy(file, target)
+        print(f"Copied {file} to {output_folder}")
+
+
+def add_thumbnails(match_data, output_folder):
+    """
+    Builds the thumbnails of all source and match images and adds their paths
+    (relative to the output folder, like the image paths) to match_data.
+    """
+    def on_disk(page_path):
+        return os.path.normpath(os.path.join(output_folder, page_path))
+
+    page_paths = set()
+    for item in match_data:
+        page_paths.update(item.get("source_paths") or [item["source_path"]])
+        page_paths.update(m["path"] for m in item["matches"])
+    thumbs = thumbnails.build_thumbnails(on_disk(p) for p in sorted(page_paths))
+
+    def thumb_of(page_path):
+        thumb = thumbs.get(on_disk(page_path))
+        return os.path.relpath(thumb, output_folder).replace(os.sep, "/") if thumb else None
+
+    for item in match_data:
+        item["source_thumb"] = thumb_of(item["source_path"])
+        item["source_thumbs"] = [thumb_of(p) for p in item.get("source_paths") or [item["source_path"]]]
+        for m in item["matches"]:
+            m["thumb"] = thumb_of(m["path"])
+
+
+def render_index(output_folder, html_name, first_base, total_groups, all_bases_json, viewer=VIEWER):
+    if not os.path.exists(INDEX_TEMPLATE_FILE):
+        print(f"Warning: '{INDEX_TEMPLATE_FILE}' not found. Skipping index generation.")
+        return
+    with open(INDEX_TEMPLATE_FILE, "r", encoding="utf-8") as f:
+        index_template = Template(f.read())
+    index_html = index_template.render(
+        html_name=html_name,
+        first_base=first_base,  # Nodig voor de 'Start' knop
+        # Link naar een object: <html_name>_<base>.html of viewer.html#<base>
+        page_prefix="viewer.html#" if viewer == "data" else html_name + "_",
+        page_suffix="" if viewer == "data" else ".html",
+        total_groups=total_groups,
+        all_bases_json=all_bases_json,  # Nodig voor de zoekbalk op de homepage
+    )
+    index_path = os.path.join(output_folder, "index.html")
+    with open(index_path, "w", encoding="utf-8") as f:
+        f.write(index_html)
+    print(f"✓ Index page written: {index_path}")
+
+
+def group_by_base(match_data):
+    """
+    Groepeer de data op basis van obj_num_base. Returns (grouped_data, sorted_bases).
+    """
+    grouped_data = defaultdict(list)
+    for item in match_data:
+        grouped_data[item.get("obj_num_base", "unknown")].append(item)
+    return grouped_data, sorted(grouped_data.keys())
+
+
+def _write_if_changed(path, text, new_state, old_state, key):
+    """
+    Writes text to path unless the state says it is already there. Returns True if written.
+    """
+    digest = _short_hash(text)
+    new_state[key] = digest
+    if old_state.get(key) == digest and os.path.exists(path):
+        return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(path + ".tmp", path)
+    return True
+
+
+def render_data_viewer(match_data, html_name, output_folder, force=False):
+    """
+    Writes viewer.html, data/bases.js and one data/objects/<base>.js per obj_num_base
+    (only the changed ones, unless force). Returns (sorted_bases, safe_bases).
+    """
+    grouped_data, sorted_bases = group_by_base(match_data)
+    safe_bases = [get_safe_base(b) for b in sorted_bases]
+    # The previous state is always loaded, for removing stale files; force only rewrites
+    old_state = load_state(output_folder, DATA_STATE_FILE)
+    unchanged = {} if force else old_state
+    state = {}
+
+    # The data files are scripts (not fetched JSON), so the viewer also works from file://
+    written = 0
+    shard_hashes = []
+    for base, safe_base in zip(sorted_bases, safe_bases):
+        shard = f"nkRegisterShard({json.dumps(safe_base)}, {json.dumps(grouped_data[base])});\n"
+        key = f"data/objects/{safe_base}.js"
+        written += _write_if_changed(os.path.join(output_folder, key), shard, state, unchanged, key)
+        shard_hashes.append(state[key])
+
+    bases = {"html_name": html_name, "total_items": len(match_data),
+             "bases": [list(b) for b in zip(safe_bases, sorted_bases, shard_hashes)]}
+    _write_if_changed(os.path.join(output_folder, "data", "bases.js"),
+                      f"nkRegisterBases({json.dumps(bases)});\n", state, unchanged, "data/bases.js")
+
+    for key in set(old_state) - set(state):
+        path = os.path.join(output_folder, key)
+        if os.path.exists(path):
+            os.remove(path)
+    print(f"Data viewer: {len(sorted_bases)} objects ({written} data files written)")
+
+    # Shared assets are requested with their content hash, so browsers can cache them
+    versions = {"bases": state["data/bases.js"]}
+    for name, file in (("styles", "styles.css"), ("script", "script.js"), ("viewer", "viewer.js")):
+        versions[name] = hashlib.sha1(_file_bytes(file)).hexdigest()[:12] if os.path.exists(file) else "0"
+    with open(VIEWER_TEMPLATE_FILE, "r", encoding="utf-8") as f:
+        viewer_html = Template(f.read()).render(html_name=html_name, versions=versions)
+    with open(os.path.join(output_folder, "viewer.html"), "w", encoding="utf-8") as f:
+        f.write(viewer_html)
+    save_state(output_folder, state, DATA_STATE_FILE)
+    return sorted_bases, safe_bases
+
+
+def remove_other_viewer(output_folder, viewer):
+    """
+    Removes what the other viewer mode wrote into output_folder, so switching between
+    "pages" and "data" doesn't leave the old site next to the new one.
+    """
+    if viewer == "data":
+        old_files = list(load_state(output_folder)) + [STATE_FILE]
+    else:
+        old_files = list(load_state(output_folder, DATA_STATE_FILE)) + ["viewer.html", DATA_STATE_FILE]
+    removed = 0
+    for name in old_files:
+        path = os.path.join(output_folder, name)
+        if os.path.exists(path):
+            os.remove(path)
+            removed += 1
+    if viewer == "pages":
+        # data/ itself only if nothing else was put there
+        for folder in ("data/objects", "data"):
+            path = os.path.join(output_folder, folder)
+            if os.path.isdir(path) and not os.listdir(path):
+                os.rmdir(path)
+    if removed:
+        print(f"Removed {removed} files of the previous viewer")
+
+
+def render_site(match_data, html_name, output_folder, workers=WORKERS, force=False, use_thumbnails=THUMBNAILS,
+                viewer=VIEWER):
+    """
+    Writes one page per obj_num_base (only the changed ones, unless force), or the
+    data-driven viewer if viewer == "data", + index.html.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    remove_other_viewer(output_folder, viewer)
+    copy_static_files(output_folder)
+    if use_thumbnails:
+        with pipeline_stats.timed("thumbnails"):
+            add_thumbnails(match_data, output_folder)
+    if not match_data:
+        print("No matches to render.")
+        return
+
+    if viewer == "data":
+        with pipeline_stats.timed("render_data_viewer"):
+            sorted_bases, safe_bases = render_data_viewer(match_data, html_name, output_folder, force)
+        render_index(output_folder, html_name, safe_bases[0], len(sorted_bases), json.dumps(sorted_bases),
+                     viewer)
+        return
+
+    grouped_data, sorted_bases = group_by_base(match_data)
+    total_groups = len(sorted_bases)
+    all_bases_json = json.dumps(sorted_bases)
+    safe_bases = [get_safe_base(b) for b in sorted_bases]
+
+    with open(TEMPLATE_FILE, "r", encoding="utf-8") as f:
+        template_source = f.read()
+    # Input shared by every page: a change here re-renders them all
+    shared_hash = _sha1(template_source + all_bases_json)
+
+    # The previous state is always loaded, for removing stale pages; force only re-renders
+    old_state = load_state(output_folder)
+    state = {}
+    todo = []
+    for i, base in enumerate(sorted_bases):
+        context = {
+            "items": grouped_data[base],
+            "current_page": i + 1,  # Voor weergave "Page 1 of 100"
+            "total_pages": total_groups,
+            "total_items": len(match_data),
+            "html_name": html_name,
+            "current_base": base,
+            "first_base": safe_bases[0],
+            "last_base": safe_bases[-1],
+            "prev_base": safe_bases[i - 1] if i > 0 else None,
+            "next_base": safe_bases[i + 1] if i < total_groups - 1 else None,
+        }
+        filename = f"{html_name}_{safe_bases[i]}.html"
+        filepath = os.path.join(output_folder, filename)
+        page_hash = _sha1(shared_hash + json.dumps(context, sort_keys=True))
+        state[filename] = page_hash
+        if force or old_state.get(filename) != page_hash or not os.path.exists(filepath):
+            todo.append((filepath, context))
+
+    # Pages of bases that are no longer in the results
+    for filename in set(old_state) - set(state):
+        filepath = os.path.join(output_folder, filename)
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+    print(f"Generating HTML files for {total_groups} unique object bases "
+          f"({len(todo)} changed, {total_groups - len(todo)} up to date)...")
+    if todo:
+        chunks = [todo[s:s + CHUNK_PAGES] for s in range(0, len(todo), CHUNK_PAGES)]
+        written = 0
+        with pipeline_stats.timed("render_pages", items=len(todo)), \
+                _executor(workers, template_source, all_bases_json) as pool:
+            for n in pool.map(_render_chunk, chunks):
+                written += n
+                print(f"Written {written}/{len(todo)} pages")
+    save_state(output_folder, state)
+
+    render_index(output_folder, html_name, safe_bases[0], total_groups, all_bases_json, viewer)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="(Re)build the HTML pages from saved matches")
+    parser.add_argument("matches", help="<output folder>/<html_name>_matches.jsonl (or .json)")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--force", action="store_true", help="re-render every page")
+    parser.add_argument("--no-thumbnails", action="store_true", help="cards load the original images")
+    parser.add_argument("--viewer", default=VIEWER, choices=["pages", "data"])
+    args = parser.parse_args()
+
+    import match_export
+
+    match_data = match_export.read_match_data(args.matches)
+    output_folder = os.path.dirname(args.matches) or "."
+    html_name = os.path.basename(args.matches).rsplit("_matches.", 1)[0]
+    render_site(match_data, html_name, output_folder, workers=args.workers, force=args.force,
+                use_thumbnails=not args.no_thumbnails, viewer=args.viewer)
+    print(f"✓ Done. Site written to '{output_folder}/'.")
+
+
+if __name__ == "__main__":
+    main()
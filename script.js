@@ -271,18 +271,10 @@ function handleKeydown(e) {
     }
 }
 
-// Event listeners
-function setupEventListeners() {
-    // Knoppen (check eerst of ze bestaan om errors te voorkomen)
-    if (downloadBtn) {
-        downloadBtn.addEventListener('click', downloadSelections);
-    }
-    if (clearSelectionsBtn) {
-        clearSelectionsBtn.addEventListener('click', clearAllSelections);
-    }
-
+// Listeners on the item cards; viewer.js calls this again for the cards it renders
+function bindItemCards(root) {
     // Match card clicks
-    document.querySelectorAll('.match-card').forEach(card => {
+    root.querySelectorAll('.match-card').forEach(card => {
         card.addEventListener('click', (e) => {
             // Don't toggle if clicking the link
             if (e.target.closest('.match-id')) return;
@@ -291,17 +283,30 @@ function setupEventListeners() {
     });
 
     // Source image clicks for preview
-    document.querySelectorAll('.source-img').forEach(img => {
-        img.addEventListener('click', () => showPreview(img.src));
+    root.querySelectorAll('.source-img').forEach(img => {
+        img.addEventListener('click', () => showPreview(img.dataset.full || img.src));
     });
 
     // Match image double-click for preview
-    document.querySelectorAll('.match-card img').forEach(img => {
+    root.querySelectorAll('.match-card img').forEach(img => {
         img.addEventListener('dblclick', (e) => {
             e.stopPropagation();
-            showPreview(img.src);
+            showPreview(img.dataset.full || img.src);
         });
     });
+}
+
+// Event listeners
+function setupEventListeners() {
+    // Knoppen (check eerst of ze bestaan om errors te voorkomen)
+    if (downloadBtn) {
+        downloadBtn.addEventListener('click', downloadSelections);
+    }
+    if (clearSelectionsBtn) {
+        clearSelectionsBtn.addEventListener('click', clearAllSelections);
+    }
+
+    bindItemCards(document);
 
     // Modal
     if (closePreviewBtn) {
@@ -333,7 +338,9 @@ if (preview) {
         }
 
         if (previewImg) {
-            previewImg.src = hovered.src;
+            // Cards show thumbnails; the preview loads the full-resolution file
+            const full = hovered.dataset.full || hovered.src;
+            if (previewImg.getAttribute('src') !== full) previewImg.src = full;
         }
 
         // Get bounding box of the hovered image
@@ -0,0 +1,290 @@
+# stream_pipeline.py
+# Raw DHM scans -> split model -> detect model -> DINO embeddings, in one pass.
+#
+# Does the work of photo_split_yolo.py, object_detect_yolo.py and the DHM embedding
+# step of compare_images_DINO_v4-2.py on in-memory arrays, without writing and
+# re-reading JPEGs in between. Model, backend, image loader, embedding cache and dir2
+# come from the nk_matcher settings (--config / --set). Output:
+#   <OUTPUT_NAME>.npy             float32 embeddings, one row per image
+#   <OUTPUT_NAME>_manifest.jsonl  one line per row: name, source scan, split box, detect box
+#   <OUTPUT_NAME>.f32             the same embeddings, appended batch by batch (raw float32)
+# (OUTPUT_NAME defaults to <index_config>_stream). These are for analysis only: the
+# index is built from image files, and without --export there are none.
+#
+# The images get the same names as the two YOLO scripts would give them
+# (<stem>.jpg, <stem>_<i>.jpg, <stem>_<i>_<j>.jpg). With --export they are written to
+# dir2, their embeddings go into the embedding cache under the hash of the written
+# file, and at the end the matcher's index stage brings the FAISS index + embedding
+# store of dir2 up to date from the cache, without embedding anything again.
+#
+# An interrupted run resumes: scans listed in the manifest are skipped (see
+# load_progress). A scan whose crops can't all be written is left out of the manifest
+# and done again on the next run.
+#
+# Example:
+#   python stream_pipeline.py --export --config configs/dinov2_base.json
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+from ultralytics import YOLO
+
+import embedding_engine
+import nk_matcher
+
+# --- CONFIGURATION ---
+SPLIT_MODEL_PATH = 'runs/detect/train3/weights/best.pt'   # as in photo_split_yolo.py
+DETECT_MODEL_PATH = 'runs/detect/train4/weights/best.pt'  # as in object_detect_yolo.py
+INPUT_FOLDER = 'DHM/DHM_images'
+
+OUTPUT_NAME = None  # None = <index_config>_stream
+EXPORT = False      # write the crops to dir2 and update the index (--export)
+
+CONF = 0.5
+IOU = 0.7
+SCAN_BATCH = 8        # raw scans per split-model call
+WRITER_THREADS = 4    # JPEG encoding for --export
+CACHE_FLUSH_EVERY = 2000  # embeddings per embedding-cache shard
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif')
+# ---------------------
+
+
+def clamp_box(box, shape):
+    h, w = shape[:2]
+    x1, y1, x2, y2 = box.xyxy[0].cpu().numpy().astype(int)
+    return [int(max(0, x1)), int(max(0, y1)), int(min(w, x2)), int(min(h, y2))]
+
+
+def split_scan(stem, img, result):
+    """
+    Same output as photo_split_yolo.py: one crop per box, or the whole scan if none.
+    Yields (name, array, split_box).
+    """
+    if len(result.boxes) == 0:
+        yield stem, img, None
+        return
+    for i, box in enumerate(result.boxes):
+        x1, y1, x2, y2 = clamp_box(box, img.shape)
+        if x2 > x1 and y2 > y1:
+            yield f"{stem}_{i}", img[y1:y2, x1:x2], [x1, y1, x2, y2]
+
+
+def detect_objects(name, img, result):
+    """
+    Same output as object_detect_yolo.py: the input itself plus one crop per box.
+    Yields (name, array, detect_box).
+    """
+    yield name, img, None
+    for j, box in enumerate(result.boxes):
+        x1, y1, x2, y2 = clamp_box(box, img.shape)
+        if x2 > x1 and y2 > y1:
+            yield f"{name}_{j}", img[y1:y2, x1:x2], [x1, y1, x2, y2]
+
+
+def encode_and_write(path, img):
+    """
+    Encodes img as JPEG, writes it and returns (sha1 of the file, decoded JPEG), or
+    None instead of raising on failure.
+    """
+    try:
+        ok, buf = cv2.imencode('.jpg', img)
+        if not ok:
+            raise ValueError("could not encode")
+        data = buf.tobytes()
+        with open(path, 'wb') as f:
+            f.write(data)
+        return hashlib.sha1(data).hexdigest(), cv2.imdecode(buf, cv2.IMREAD_COLOR)
+    except Exception as e:
+        print(f"Error writing {path}: {e}")
+        return None
+
+
+def load_progress(output_name, dim):
+    """
+    Returns the scans a previous (possibly interrupted) run finished and truncates the
+    manifest and the .f32 embeddings to their rows. The last scan in the manifest may
+    have been cut short, so it is dropped and done again.
+    """
+    manifest_file, emb_file = output_name + "_manifest.jsonl", output_name + ".f32"
+    lines = []
+    if os.path.exists(manifest_file):
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    lines.append((json.loads(line)['source'], line))
+                except (ValueError, KeyError):
+                    break  # incomplete last line
+    if lines:
+        last = lines[-1][0]
+        while lines and lines[-1][0] == last:
+            lines.pop()
+    row_bytes = dim * 4
+    if lines and (not os.path.exists(emb_file) or os.path.getsize(emb_file) < len(lines) * row_bytes):
+        print(f"Warning: {emb_file} doesn't match {manifest_file}, starting over")
+        lines = []
+    with open(manifest_file, 'w', encoding='utf-8') as f:
+        f.writelines(line for _, line in lines)
+    with open(emb_file, 'ab') as f:
+        f.truncate(len(lines) * row_bytes)
+    return {source for source, _ in lines}
+
+
+def run_pipeline(config, input_folder=INPUT_FOLDER, output_name=OUTPUT_NAME, export=EXPORT):
+    for model_path in (SPLIT_MODEL_PATH, DETECT_MODEL_PATH):
+        if not os.path.exists(model_path):
+            print(f"Error: Model not found at {model_path}. Please train it first.")
+            return
+
+    split_model = YOLO(SPLIT_MODEL_PATH)
+    detect_model = YOLO(DETECT_MODEL_PATH)
+    # Same model, backend, image loader and embedding cache (namespace) as the matcher
+    matcher = nk_matcher.Matcher(config)
+    processor, model, device, _ = matcher.model()
+    output_name = output_name or matcher.index_config + "_stream"
+    export_folder = config["dir2"] if export else None
+    # Draft decoding only applies to JPEG files: with it, embed the written files, as the matcher will
+    embed_files = export and config["image_loader"] == "draft"
+
+    cache = None
+    if export_folder:
+        os.makedirs(export_folder, exist_ok=True)
+        cache = matcher.embedding_cache
+        if cache is None:
+            print("Warning: no embedding_cache_dir; the index stage will embed the exported crops again")
+
+    os.makedirs(os.path.dirname(output_name) or ".", exist_ok=True)
+    dim = model.config.hidden_size
+    done = load_progress(output_name, dim)
+    scans = sorted(p for p in Path(input_folder).iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+    todo = [p for p in scans if str(p) not in done]
+    print(f"Found {len(scans)} scans in {input_folder}, {len(scans) - len(todo)} already done")
+
+    pending_keys, pending_embs = [], []  # new cache entries, stored in larger shards
+    writer = ThreadPoolExecutor(max_workers=WRITER_THREADS) if export_folder else None
+    # Per batch: embeddings first, then the manifest rows that mark the scans as done
+    with open(output_name + ".f32", "ab") as emb_out, \
+            open(output_name + "_manifest.jsonl", "a", encoding="utf-8") as manifest:
+        for start in tqdm(range(0, len(todo), SCAN_BATCH), desc="Scans (batches)"):
+            batch = todo[start:start + SCAN_BATCH]
+            images = [(p, cv2.imread(str(p))) for p in batch]
+            images = [(p, img) for p, img in images if img is not None]
+            if not images:
+                continue
+
+            # 1. Split scans into photos
+            split_results = split_model.predict([img for _, img in images], conf=CONF, iou=IOU, verbose=False)
+            parts = []
+            for (path, img), result in zip(images, split_results):
+                for name, part, split_box in split_scan(path.stem, img, result):
+                    parts.append((path, name, part, split_box))
+            if not parts:
+                continue
+
+            # 2. Detect objects in every photo
+            detect_results = detect_model.predict([part for _, _, part, _ in parts], conf=CONF, iou=IOU,
+                                                  verbose=False)
+            records = []
+            for (path, name, part, split_box), result in zip(parts, detect_results):
+                for out_name, crop, detect_box in detect_objects(name, part, result):
+                    records.append({
+                        "name": out_name + ".jpg",
+                        "source": str(path),
+                        "split_box": split_box,
+                        "detect_box": detect_box,
+                        "crop": crop,
+                    })
+
+            # 3. Optional export (the cache is keyed on the written file)
+            keys = None
+            if writer is not None:
+                futures = [writer.submit(encode_and_write, os.path.join(export_folder, r["name"]), r["crop"])
+                           for r in records]
+                written = [future.result() for future in futures]
+                failed = {r["source"] for r, result in zip(records, written) if result is None}
+                for source in sorted(failed):
+                    print(f"Error writing output for {source}, will be retried on the next run")
+                kept = [(r, result) for r, result in zip(records, written) if r["source"] not in failed]
+                records = [r for r, _ in kept]
+                if not records:
+                    continue
+                keys = []
+                for r, (digest, decoded) in kept:
+                    # Embed what the matcher will later read from disk
+                    r["crop"] = decoded
+                    keys.append(digest)
+                    if cache is not None:
+                        cache.hashes.remember(os.path.join(export_folder, r["name"]), digest)
+
+            # 4. Embed (in memory as BGR -> RGB PIL images, or the written files with draft decoding)
+            if embed_files:
+                sources = [os.path.join(export_folder, r["name"]) for r in records]
+            else:
+                sources = [Image.fromarray(cv2.cvtColor(r["crop"], cv2.COLOR_BGR2RGB)) for r in records]
+            embs = embedding_engine.compute_image_embeddings(
+                sources, processor, model, device,
+                batch_size=config["embed_batch_size"], num_workers=config["embed_workers"],
+                prefetch_batches=config["embed_prefetch"], desc="Embedding crops", loader=matcher.loader)
+            emb_out.write(np.ascontiguousarray(embs, dtype="float32").tobytes())
+            emb_out.flush()
+            if cache is not None:
+                ok = np.linalg.norm(embs, axis=1) > 0
+                pending_keys += [k for k, good in zip(keys, ok) if good]
+                pending_embs.append(embs[ok])
+                if len(pending_keys) >= CACHE_FLUSH_EVERY:
+                    cache.put_many(pending_keys, np.vstack(pending_embs))
+                    pending_keys, pending_embs = [], []
+
+            for r in records:
+                del r["crop"]
+                if export_folder:
+                    r["path"] = os.path.join(export_folder, r["name"])
+            manifest.write("".join(json.dumps(r) + "\n" for r in records))
+            manifest.flush()
+
+    if writer is not None:
+        writer.shutdown()
+    if cache is not None:
+        if pending_keys:
+            cache.put_many(pending_keys, np.vstack(pending_embs))
+        cache.save()
+
+    embeddings = np.fromfile(output_name + ".f32", dtype="float32").reshape(-1, dim)
+    np.save(output_name + ".npy", embeddings)
+    print(f"✓ {len(embeddings)} embeddings written to {output_name}.npy (+ _manifest.jsonl)")
+
+    if export_folder:
+        # Every exported crop is in the cache by now, so this only hashes files
+        matcher.index_stage()
+        print(f"✓ Index of {export_folder}: {matcher.index.ntotal} vectors")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Raw DHM scans -> split -> detect -> DINO embeddings in one pass")
+    parser.add_argument("--config", action="append", default=[], metavar="JSON", help="nk_matcher settings")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", dest="overrides")
+    parser.add_argument("--input", default=INPUT_FOLDER, help="folder with the raw scans")
+    parser.add_argument("--output", default=OUTPUT_NAME, help="prefix of the .npy + _manifest.jsonl")
+    parser.add_argument("--export", action="store_true", default=EXPORT,
+                        help="write the crops to dir2 and bring the matcher's index up to date")
+    args = parser.parse_args()
+    try:
+        config = nk_matcher.load_config(args.config, args.overrides)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    try:
+        run_pipeline(config, args.input, args.output, args.export)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
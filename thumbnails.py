@@ -0,0 +1,74 @@
+# thumbnails.py
+# Content-addressed thumbnail cache for the match viewer.
+#
+# A thumbnail is stored as <THUMB_DIR>/<sha1[:2]>/<sha1>_<size>.<format>, where sha1 is
+# the hash of the source file's content. The same image used by several runs or
+# result sets gets one thumbnail, an edited image gets a new one, and existing
+# thumbnails are never rebuilt. File hashes are memoised by (size, mtime) in the
+# same way as the embedding cache (embedding_cache.FileHashIndex).
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+from tqdm import tqdm
+
+from embedding_cache import FileHashIndex
+
+THUMB_DIR = "thumbnails"
+THUMB_SIZE = 384  # longest side in px (match cards are 190 px wide, x2 for HiDPI screens)
+THUMB_FORMAT = "webp"  # "webp" or "jpeg"
+THUMB_QUALITY = 80
+WORKERS = 8  # decoding / resizing / encoding run in C code and release the GIL
+
+
+def thumb_path(digest, size=THUMB_SIZE, fmt=THUMB_FORMAT, thumb_dir=THUMB_DIR):
+    ext = "jpg" if fmt == "jpeg" else fmt
+    return os.path.join(thumb_dir, digest[:2], f"{digest}_{size}.{ext}")
+
+
+def make_thumbnail(source, target, size=THUMB_SIZE, fmt=THUMB_FORMAT, quality=THUMB_QUALITY):
+    """
+    Writes a thumbnail of source (longest side <= size) to target. Returns True on success.
+    """
+    try:
+        with Image.open(source) as img:
+            # JPEG: let the decoder downscale by 1/2, 1/4 or 1/8 (much faster for large scans)
+            img.draft("RGB", (size, size))
+            img = img.convert("RGB")
+            img.thumbnail((size, size), Image.LANCZOS)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp = target + ".tmp"
+            img.save(tmp, format=fmt.upper(), quality=quality)
+        os.replace(tmp, target)
+        return True
+    except Exception as e:
+        print(f"Error creating thumbnail for {source}: {e}")
+        return False
+
+
+def build_thumbnails(paths, size=THUMB_SIZE, fmt=THUMB_FORMAT, thumb_dir=THUMB_DIR, workers=WORKERS,
+                     hashes=None):
+    """
+    Makes sure every image in paths has a thumbnail. Returns {path: thumbnail path}
+    (images that can't be read or converted are left out).
+    """
+    hashes = hashes or FileHashIndex(thumb_dir)
+    paths = list(dict.fromkeys(paths))
+    result, todo, queued = {}, [], set()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for path, digest in zip(paths, pool.map(hashes.get, paths)):
+            if digest is None:
+                continue
+            target = thumb_path(digest, size, fmt, thumb_dir)
+            # Identical files share one thumbnail: make it once
+            if target not in queued and not os.path.exists(target):
+                todo.append((path, target))
+                queued.add(target)
+            result[path] = target
+        hashes.save()
+
+        print(f"Thumbnails: {len(result)} images, {len(todo)} new thumbnails to make ({thumb_dir})")
+        jobs = [pool.submit(make_thumbnail, path, target, size, fmt) for path, target in todo]
+        failed = {target for (_, target), job in tqdm(zip(todo, jobs), total=len(jobs), desc="Thumbnails")
+                  if not job.result()}
+    return {path: target for path, target in result.items() if target not in failed}
@@ -0,0 +1,168 @@
+// viewer.js
+// Data-driven viewer (render_site.py, VIEWER = "data"): one viewer.html for all objects.
+// data/bases.js registers the list of bases; the matches of one object are loaded
+// on demand from data/objects/<base>.js. Both are plain <script> files instead of
+// JSON via fetch(), so the viewer also works when opened from a file share.
+// Shard URLs carry a content hash, so the browser may cache them indefinitely.
+
+let viewerIndex = null;         // {html_name, total_items, bases: [[safe base, base, hash], ...]}
+const loadedShards = {};        // safe base -> items
+const pendingShards = {};       // safe base -> [callbacks]
+
+function nkRegisterBases(data) {
+    viewerIndex = data;
+}
+
+function nkRegisterShard(safeBase, items) {
+    loadedShards[safeBase] = items;
+    (pendingShards[safeBase] || []).forEach(cb => cb(items));
+    delete pendingShards[safeBase];
+}
+
+function loadShard(position, callback) {
+    const [safeBase, , hash] = viewerIndex.bases[position];
+    if (loadedShards[safeBase]) {
+        callback(loadedShards[safeBase]);
+        return;
+    }
+    if (pendingShards[safeBase]) {
+        pendingShards[safeBase].push(callback);
+        return;
+    }
+    pendingShards[safeBase] = [callback];
+    const tag = document.createElement('script');
+    tag.src = `data/objects/${encodeURIComponent(safeBase)}.js?v=${hash}`;
+    tag.onerror = () => showToast(`Kon gegevens voor '${safeBase}' niet laden`, 'error');
+    document.head.appendChild(tag);
+}
+
+function escapeHtml(value) {
+    return String(value ?? '').replace(/[&<>"']/g, c => ({
+        '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'
+    }[c]));
+}
+
+// Same markup as the item cards in template.html
+function renderItem(item) {
+    const sourcePaths = item.source_paths || [item.source_path];
+    const sourceThumbs = item.source_thumbs || [];
+    const extras = sourcePaths.slice(1).map((path, i) => `
+        <img class="source-img" src="${escapeHtml(sourceThumbs[i + 1] || path)}" data-full="${escapeHtml(path)}"
+             alt="${escapeHtml(item.object_number)}" loading="lazy">`).join('');
+    const matches = item.matches.map((match, i) => `
+        <div class="match-card" data-match-index="${i}" data-filename="${escapeHtml(match.filename)}"
+             data-base="${escapeHtml(match.base)}" data-similarity="${match.similarity}" tabindex="0">
+            <img src="${escapeHtml(match.thumb || match.path)}" data-full="${escapeHtml(match.path)}"
+                 alt="${escapeHtml(match.base)}" loading="lazy">
+            <div class="match-info">
+                <a href="${escapeHtml(match.url)}" target="_blank" class="match-id">${escapeHtml(match.base)}</a>
+                <div class="similarity-bar">
+                    <div class="similarity-fill" style="width: ${Math.round(match.similarity * 100)}%"></div>
+                </div>
+                <span class="similarity-value">${(match.similarity * 100).toFixed(1)}%</span>
+            </div>
+        </div>`).join('');
+
+    return `
+    <article class="item-card" data-index="${item.index}" data-object-number="${escapeHtml(item.object_number)}"
+             data-source-filename="${escapeHtml(item.source_filename)}">
+        <div class="item-header" style="justify-content: flex-start; gap: 20px;">
+            <h2 class="object-number"> <a href="${escapeHtml(item.obj_NK_url)}" target="_blank">${escapeHtml(item.object_number)}</a></h2>
+            <span class="item-meta">${escapeHtml(item.obj_metadata)}</span>
+        </div>
+        <div class="item-content">
+            <div class="source-section">
+                <img class="source-img" src="${escapeHtml(item.source_thumb || item.source_path)}"
+                     data-full="${escapeHtml(item.source_path)}" alt="${escapeHtml(item.object_number)}" loading="lazy">
+                <div class="source-filename">${escapeHtml(item.source_filename)}</div>
+                ${extras ? `<div class="source-extra">${extras}</div>` : ''}
+            </div>
+            <div class="matches-section">
+                <div class="matches-slider" data-item-index="${item.index}">${matches}</div>
+            </div>
+        </div>
+    </article>`;
+}
+
+function positionFromHash() {
+    const safeBase = decodeURIComponent(location.hash.slice(1));
+    const position = viewerIndex.bases.findIndex(b => b[0] === safeBase);
+    return position >= 0 ? position : 0;
+}
+
+function updatePagination(position) {
+    const bases = viewerIndex.bases;
+    const last = bases.length - 1;
+    const targets = {
+        '.nav-first': 0,
+        '.nav-prev': position > 0 ? position - 1 : null,
+        '.nav-next': position < last ? position + 1 : null,
+        '.nav-last': last,
+    };
+    Object.entries(targets).forEach(([selector, target]) => {
+        document.querySelectorAll(selector).forEach(a => {
+            a.href = target === null ? '#' + bases[position][0] : '#' + bases[target][0];
+            const disabled = (selector === '.nav-first' || selector === '.nav-prev') ? position === 0 : position === last;
+            a.classList.toggle('disabled', disabled);
+        });
+    });
+    document.querySelectorAll('.page-info').forEach(el => {
+        el.textContent = `Page ${position + 1} of ${bases.length} (${viewerIndex.total_items} items)`;
+    });
+    document.title = `Image Matching - Page ${position + 1} of ${bases.length}`;
+}
+
+function showObject() {
+    const position = positionFromHash();
+    updatePagination(position);
+    loadShard(position, items => {
+        if (position !== positionFromHash()) return;  // user navigated on in the meantime
+        itemsContainer.innerHTML = items.map(renderItem).join('');
+        bindItemCards(itemsContainer);
+        restoreSelections();
+        currentItemIndex = 0;
+        currentMatchIndex = 0;
+        window.scrollTo(0, 0);
+        // Prefetch the next object, so paging forward is instant
+        if (position + 1 < viewerIndex.bases.length) loadShard(position + 1, () => {});
+    });
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    if (!viewerIndex || viewerIndex.bases.length === 0) {
+        itemsContainer.textContent = 'Geen gegevens gevonden (data/bases.js).';
+        return;
+    }
+    showObject();
+    window.addEventListener('hashchange', showObject);
+
+    // Zoeken op NK-nummer
+    const input = document.getElementById('objInput');
+    const btn = document.getElementById('btnSearchObj');
+    const dataList = document.getElementById('nk_numbers');
+    const safeBases = viewerIndex.bases.map(b => b[0]);
+
+    if (dataList) {
+        const fragment = document.createDocumentFragment();
+        viewerIndex.bases.forEach(b => {
+            const option = document.createElement('option');
+            option.value = b[1];
+            fragment.appendChild(option);
+        });
+        dataList.appendChild(fragment);
+    }
+
+    function navigateToBase() {
+        let val = input.value.trim();
+        if (!val) return;
+        let base = val.split('-')[0].replace(/\//g, "_").replace(/\\/g, "_");
+        if (safeBases.includes(base)) {
+            location.hash = base;
+        } else {
+            showToast("Object nummer '" + base + "' niet gevonden.", "error");
+        }
+    }
+
+    if (btn) btn.addEventListener('click', navigateToBase);
+    if (input) input.addEventListener('keypress', e => { if (e.key === 'Enter') navigateToBase(); });
+});